@@ -0,0 +1,723 @@
+"""
+離線壓測：以本機替身取代 Twitter、Discord 與 MySQL，量測輪詢與 API 熱路徑的吞吐量與延遲分佈。
+
+- Twitter：覆寫 TwitterSessionPool._open，回傳模擬延遲與發文機率的假客戶端
+- Discord：本機 aiohttp 伺服器接收 Webhook，並以推文網址中的時間戳計算端到端延遲
+- MySQL：記憶體中的 follow_data 資料表，套在原本的 DatabasePool 底下（連線等待統計照常運作）
+- Redis：預設連到 TWITTER_REDIS_URL（本機 Redis，所有鍵加上 bench: 前綴），
+  --fake-redis 改用 fakeredis（需另外安裝 fakeredis 與 lupa）
+- 事件迴圈：/savetemplate 壓測期間以 LoopLagProbe 量測 asyncio.sleep(0) 的延遲，並與閒置時對照
+- 啟動：在獨立行程中依 TWITTER_ROLE 量測 API 模組匯入與 lifespan 啟動完成的時間
+
+用法:
+    python bench.py --targets 5000 --subscribers 3 --rounds 3
+    python bench.py --fake-redis --skip-api --json bench_output.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+# 壓測不需要真實帳號與 Cloudflare，未設定時給預設值讓模組可以匯入
+os.environ.setdefault("TWITTER_REDIS_URL", "redis://localhost:6379/0")
+os.environ.setdefault("username_dict", '{"bench": "bench"}')
+os.environ.setdefault("TWITTER_TURNSTILE_MODE", "local")
+
+import aiohttp.web
+import httpx
+from redis.commands.core import AsyncScript
+
+import twitter_hook as th
+
+BENCH_PREFIX = "bench:"
+
+
+def percentile(samples: List[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(name: str, samples: List[float], elapsed: float, errors: int = 0) -> dict:
+    """輸出一行統計並回傳 JSON 用的摘要"""
+    result = {
+        "name": name,
+        "count": len(samples),
+        "errors": errors,
+        "throughput": len(samples) / elapsed if elapsed > 0 else 0.0,
+        "p50_ms": percentile(samples, 0.5) * 1000,
+        "p95_ms": percentile(samples, 0.95) * 1000,
+        "p99_ms": percentile(samples, 0.99) * 1000,
+        "max_ms": max(samples, default=0.0) * 1000,
+    }
+    print(
+        f"📊 {name}: {result['count']} 次，{result['throughput']:.0f} 次/秒，"
+        f"p50 {result['p50_ms']:.1f}ms / p95 {result['p95_ms']:.1f}ms / "
+        f"p99 {result['p99_ms']:.1f}ms / 最大 {result['max_ms']:.1f}ms，錯誤 {errors}"
+    )
+    return result
+
+
+# --- 假 MySQL ---
+class FakeCursor:
+    """只支援專案實際用到的 SQL，遇到新查詢時直接報錯，提醒同步更新替身"""
+
+    def __init__(self, db: "FakeMySQLPool"):
+        self.db = db
+        self.rowcount = 0
+        self.lastrowid = None
+        self._result: List[tuple] = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, sql: str, args: tuple = ()):
+        if self.db.latency:
+            await asyncio.sleep(self.db.latency)
+        sql = " ".join(sql.split())
+        rows = self.db.rows
+        columns = lambda row: (row["id"], row["follow_user"], row["webhook_url"], row["notify"], row["state"])
+
+        if sql == "SELECT 1":
+            self._result = [(1,)]
+        elif sql == "SELECT NOW(3)":
+            self._result = [(datetime.now(),)]
+        elif sql == "SELECT COUNT(*) FROM follow_data WHERE state = 1":
+            self._result = [(sum(1 for row in rows.values() if row["state"] == 1),)]
+        elif sql.startswith("SELECT id, follow_user, webhook_url, notify, state FROM follow_data WHERE state = 1"):
+            self._result = [columns(row) for row in rows.values() if row["state"] == 1]
+        elif sql.startswith("SELECT id, follow_user, webhook_url, notify, state FROM follow_data WHERE updated_at >="):
+            since = args[0] - timedelta(seconds=args[1])
+            self._result = [columns(row) for row in rows.values() if row["updated_at"] >= since]
+        elif sql.startswith("INSERT INTO follow_data (follow_user, webhook_url, notify)"):
+            follow_user, webhook_url, notify = args
+            row = self.db.by_key.get((follow_user, webhook_url))
+            if row is None:
+                self.lastrowid = self.db.insert(follow_user, webhook_url, notify)
+                self.rowcount = 1
+            elif row["notify"] != notify:
+                row["notify"] = notify
+                row["updated_at"] = datetime.now()
+                self.lastrowid = row["id"]
+                self.rowcount = 2
+            else:
+                self.lastrowid = row["id"]
+                self.rowcount = 0
+        elif sql == "UPDATE follow_data SET state = 0 WHERE id = %s AND state = 1":
+            row = rows.get(args[0])
+            self.rowcount = 0
+            if row is not None and row["state"] == 1:
+                row["state"] = 0
+                row["updated_at"] = datetime.now()
+                self.rowcount = 1
+        else:
+            raise NotImplementedError(f"壓測用假資料庫不支援此查詢: {sql}")
+
+    async def fetchone(self):
+        return self._result[0] if self._result else None
+
+    async def fetchall(self):
+        return list(self._result)
+
+
+class FakeConnection:
+    def __init__(self, db: "FakeMySQLPool"):
+        self.db = db
+
+    def cursor(self) -> FakeCursor:
+        return FakeCursor(self.db)
+
+
+class FakeMySQLPool:
+    """取代 aiomysql 連線池：maxsize 個連線以 Semaphore 表示，查詢延遲可調"""
+
+    def __init__(self, maxsize: int, latency: float):
+        self.latency = latency
+        self.rows: Dict[int, dict] = {}
+        self.by_key: Dict[tuple, dict] = {}
+        self._next_id = 1
+        self._semaphore = asyncio.Semaphore(maxsize)
+
+    def insert(self, follow_user: str, webhook_url: str, notify: str) -> int:
+        row_id = self._next_id
+        self._next_id += 1
+        row = {
+            "id": row_id,
+            "follow_user": follow_user,
+            "webhook_url": webhook_url,
+            "notify": notify,
+            "state": 1,
+            "updated_at": datetime.now(),
+        }
+        self.rows[row_id] = row
+        self.by_key[(follow_user, webhook_url)] = row
+        return row_id
+
+    @asynccontextmanager
+    async def acquire(self):
+        async with self._semaphore:
+            yield FakeConnection(self)
+
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+
+class FakeDatabasePool(th.DatabasePool):
+    """沿用 DatabasePool 的取得連線與統計邏輯，只把底層換成記憶體資料表"""
+
+    def __init__(self, latency: float):
+        self.fake = FakeMySQLPool(th.Config.DB_POOL_MAXSIZE, latency)
+        super().__init__()
+
+    async def connect(self) -> bool:
+        self._pool = self.fake
+        return True
+
+
+# --- 假 Twitter ---
+class FakeTwitter:
+    """模擬 tweety 客戶端：每個目標有一條時間軸，每次抓取有 new_tweet_rate 機率出現新推文"""
+
+    is_user_authorized = True
+    PAGE_SIZE = 20
+    SEED_TWEETS = 30
+
+    def __init__(self, latency: float, new_tweet_rate: float):
+        self.latency = latency
+        self.new_tweet_rate = new_tweet_rate
+        self.user_ids: Dict[str, int] = {}
+        self.usernames: Dict[int, str] = {}
+        self.timelines: Dict[str, List[SimpleNamespace]] = {}  # 由新到舊
+        self.calls = 0
+
+    async def _delay(self):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+
+    @staticmethod
+    def _tweet(username: str, created_on: datetime) -> SimpleNamespace:
+        return SimpleNamespace(
+            url=f"https://x.com/{username}/status/{int(created_on.timestamp())}?t={time.perf_counter():.6f}",
+            created_on=created_on,
+            is_retweet=False,
+            author=SimpleNamespace(username=username),
+        )
+
+    def _timeline(self, username: str) -> List[SimpleNamespace]:
+        timeline = self.timelines.get(username)
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        if timeline is None:
+            # 第一次抓取時建立一段舊推文，讓翻頁有內容可讀
+            timeline = [self._tweet(username, now - timedelta(minutes=i + 1)) for i in range(self.SEED_TWEETS)]
+            self.timelines[username] = timeline
+        elif random.random() < self.new_tweet_rate:
+            # 推文時間以秒為單位比較，確保新推文一定晚於上一則
+            created_on = max(now, timeline[0].created_on + timedelta(seconds=1))
+            timeline.insert(0, self._tweet(username, created_on))
+            del timeline[self.SEED_TWEETS * 2 :]
+        return timeline
+
+    async def get_user_info(self, username: str):
+        await self._delay()
+        user_id = self.user_ids.setdefault(username, len(self.user_ids) + 1)
+        self.usernames[user_id] = username
+        return SimpleNamespace(id=user_id, username=username)
+
+    async def iter_tweets(self, user, pages: int = 1, wait_time=2):
+        username = self.usernames[user] if isinstance(user, int) else user.username
+        timeline = self._timeline(username)
+        for page in range(pages):
+            chunk = timeline[page * self.PAGE_SIZE : (page + 1) * self.PAGE_SIZE]
+            if not chunk:
+                break
+            await self._delay()
+            yield self, chunk
+
+
+class RateLimitedTwitter:
+    """模擬被限流的帳號：每次呼叫都拋出 RateLimitReached"""
+
+    is_user_authorized = True
+
+    def __init__(self, twitter: FakeTwitter):
+        self.twitter = twitter
+
+    def _error(self):
+        self.twitter.calls += 1
+        return th.tweety_errors().RateLimitReached(88, "RateLimitExceeded", None, retry_after=3600)
+
+    async def get_user_info(self, username: str):
+        raise self._error()
+
+    async def iter_tweets(self, user, pages: int = 1, wait_time=2):
+        raise self._error()
+        yield
+
+
+class FakeTwitterSessionPool(th.TwitterSessionPool):
+    """所有驗證帳號共用同一個假客戶端，broken 內的帳號一律被限流"""
+
+    def __init__(self, app: FakeTwitter, broken: set):
+        super().__init__(idle_timeout=th.Config.SESSION_IDLE_TIMEOUT)
+        self.app = app
+        self.broken = broken
+
+    async def _open(self, auth_user: str, auth_pass: str):
+        if auth_user in self.broken:
+            return RateLimitedTwitter(self.app)
+        return self.app
+
+
+# --- 本機 Webhook 接收端 ---
+class WebhookSink:
+    """接收 Webhook 的本機伺服器，依推文網址內的時間戳計算抓取到送達的延遲"""
+
+    TIMESTAMP = re.compile(r"\?t=([0-9.]+)")
+
+    def __init__(self, rate_limit_rate: float = 0.0):
+        self.rate_limit_rate = rate_limit_rate
+        self.requests = 0
+        self.rate_limited = 0
+        self.delivered = 0
+        self.delays: List[float] = []
+        self._runner: Optional[aiohttp.web.AppRunner] = None
+        self.url = ""
+
+    async def _handle(self, request):
+        self.requests += 1
+        if self.rate_limit_rate and random.random() < self.rate_limit_rate:
+            self.rate_limited += 1
+            return aiohttp.web.json_response({"retry_after": 0.1}, status=429, headers={"Retry-After": "0.1"})
+        payload = await request.json()
+        now = time.perf_counter()
+        for stamp in self.TIMESTAMP.findall(payload.get("content", "")):
+            self.delivered += 1
+            self.delays.append(now - float(stamp))
+        return aiohttp.web.Response(status=204)
+
+    async def start(self):
+        app = aiohttp.web.Application()
+        app.router.add_post("/hook/{id}", self._handle)
+        self._runner = aiohttp.web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = aiohttp.web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}/hook"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+# --- Redis ---
+def isolate_redis_keys():
+    """所有 twitter:* 鍵加上 bench: 前綴，避免碰到正式資料"""
+    for name, value in vars(th.Config).items():
+        if isinstance(value, str) and value.startswith("twitter:"):
+            setattr(th.Config, name, BENCH_PREFIX + value)
+    th.delivery_queue.processing_key = f"{th.Config.WEBHOOK_PROCESSING_KEY}:{th.WORKER_ID}"
+
+
+def use_fake_redis():
+    try:
+        import fakeredis
+    except ImportError:
+        raise SystemExit("--fake-redis 需要安裝 fakeredis 與 lupa")
+    # 沿用正式環境連線池的大小與排隊行為
+    pool = th.redis.BlockingConnectionPool(
+        connection_class=fakeredis.aioredis.FakeConnection,
+        max_connections=th.redis_pool.max_connections,
+        server=fakeredis.FakeServer(),
+    )
+    client = th.redis.Redis(connection_pool=pool)
+    th.redis_client = client
+    # 模組層級註冊的 Lua 腳本綁定在原本的連線上，改綁到 fakeredis
+    for name, value in list(vars(th).items()):
+        if isinstance(value, AsyncScript):
+            setattr(th, name, client.register_script(value.script))
+
+
+async def stop_delivery_queue(fake_redis: bool):
+    """
+    停止發送佇列。
+
+    fakeredis 以背景 task 模擬 BRPOPLPUSH，取消後不一定會返回；先取消 worker，
+    再對佇列推入喚醒用的訊息讓模擬的阻塞呼叫結束（真實 Redis 不需要）。
+    """
+    if fake_redis:
+        for task in th.delivery_queue._tasks:
+            task.cancel()
+        await asyncio.sleep(0)
+        await th.redis_client.lpush(th.Config.WEBHOOK_QUEUE_KEY, *(["{}"] * th.delivery_queue.workers))
+    await th.delivery_queue.stop()
+
+
+async def clear_bench_keys():
+    async for key in th.redis_client.scan_iter(match=f"{BENCH_PREFIX}*"):
+        await th.redis_client.delete(key)
+
+
+# --- 輪詢壓測 ---
+async def bench_poller(args, db: FakeDatabasePool, sink: WebhookSink) -> List[dict]:
+    print(f"🚀 輪詢壓測：{args.targets} 個目標 × {args.subscribers} 個訂閱，{args.rounds} 輪")
+    for target in range(args.targets):
+        for subscriber in range(args.subscribers):
+            # --webhooks 讓多個訂閱共用 Webhook（同一目標的訂閱仍落在不同 Webhook）
+            hook = target * args.subscribers + subscriber
+            hook = hook % args.webhooks if args.webhooks else f"{target}-{subscriber}"
+            db.fake.insert(f"user{target}", f"{sink.url}/{hook}", f"通知 {target}")
+
+    twitter = FakeTwitter(args.twitter_latency, args.new_tweet_rate)
+    broken = {auth_user for auth_user, _ in th.Config.ACCOUNT_LIST[: args.broken_accounts]}
+    th.twitter_sessions = FakeTwitterSessionPool(twitter, broken)
+
+    # 每個目標的處理時間
+    task_latencies: List[float] = []
+    process_user_tasks = th.process_user_tasks
+
+    async def timed_process_user_tasks(*a, **kw):
+        start = time.perf_counter()
+        try:
+            return await process_user_tasks(*a, **kw)
+        finally:
+            task_latencies.append(time.perf_counter() - start)
+
+    th.process_user_tasks = timed_process_user_tasks
+
+    # 記錄排入佇列的通知數（合併後一則訊息可能含多則推文），用來判斷是否已全部送達
+    enqueued = 0
+    enqueue = th.delivery_queue.enqueue
+
+    async def counting_enqueue(messages):
+        nonlocal enqueued
+        enqueued += sum(len(WebhookSink.TIMESTAMP.findall(content)) for _, content in messages)
+        await enqueue(messages)
+
+    th.delivery_queue.enqueue = counting_enqueue
+    await th.delivery_queue.start()
+
+    results = []
+    round_times: List[float] = []
+    start = time.perf_counter()
+    try:
+        for round_no in range(args.rounds):
+            # 讓所有目標在本輪到期
+            for target_user in list(th.subscription_index.grouped):
+                th.poll_scheduler.schedule(target_user, 0)
+            round_start = time.perf_counter()
+            await th.main(db)
+            round_times.append(time.perf_counter() - round_start)
+            print(f"   ⏱️ 第 {round_no + 1} 輪 {round_times[-1]:.2f} 秒，累計排入 {enqueued} 則通知")
+        poll_elapsed = time.perf_counter() - start
+
+        # 等待發送佇列清空
+        deadline = time.monotonic() + args.drain_timeout
+        while sink.delivered < enqueued and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        total_elapsed = time.perf_counter() - start
+    finally:
+        await stop_delivery_queue(args.fake_redis)
+        th.process_user_tasks = process_user_tasks
+        th.delivery_queue.enqueue = enqueue
+
+    results.append(summarize("輪詢一輪", round_times, poll_elapsed))
+    results.append(summarize("單一目標處理", task_latencies, poll_elapsed))
+    results.append(summarize("通知送達 (抓取→Webhook)", sink.delays, total_elapsed, errors=enqueued - sink.delivered))
+    print(
+        f"   🐦 Twitter 呼叫 {twitter.calls} 次；Webhook 請求 {sink.requests} 次，"
+        f"其中 429 {sink.rate_limited} 次；DB 等待最大 {db.max_wait * 1000:.1f}ms"
+    )
+    return results
+
+
+# --- API 壓測 ---
+async def run_load(name: str, make_request, total: int, concurrency: int) -> dict:
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            start = time.perf_counter()
+            try:
+                response = await make_request(i)
+                if response.status_code >= 400:
+                    errors += 1
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(name, latencies, time.perf_counter() - start, errors)
+
+
+class LoopLagProbe:
+    """背景每毫秒量一次 asyncio.sleep(0) 被排回事件迴圈的延遲，用來確認同步 I/O 沒有卡住迴圈"""
+
+    INTERVAL = 0.001
+
+    def __init__(self):
+        self.samples: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+        self._start = 0.0
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.INTERVAL)
+            start = time.perf_counter()
+            await asyncio.sleep(0)
+            self.samples.append(time.perf_counter() - start)
+
+    def start(self):
+        self._start = time.perf_counter()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, name: str) -> dict:
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        return summarize(name, self.samples, time.perf_counter() - self._start)
+
+
+async def bench_api(args, db: FakeDatabasePool, sink: WebhookSink) -> List[dict]:
+    import twitter_webhook_api as api
+
+    print(f"🚀 API 壓測：每個端點 {args.requests} 次請求，併發 {args.concurrency}")
+    template_dir = tempfile.mkdtemp(prefix="bench_templates_")
+    api.TEMPLATE_DIR = api.Path(template_dir)
+    api.template_store = api.TemplateStore(api.TEMPLATE_DIR)
+    api.error_webhook = f"{sink.url}/error"
+    # 壓測會建立大量訂閱，放寬名額上限
+    api.username_dict_count = 1
+    api.one_username_limit = args.requests * 10
+    api.app.state.db_pool = db
+    api.app.state.turnstile = api.LocalTurnstileVerifier()
+
+    for i in range(args.templates):
+        path = api.TEMPLATE_DIR / f"seed{i}.json"
+        path.write_text(json.dumps({"color": f"#{i:06x}", "font": "sans-serif", "size": i}), encoding="utf-8")
+    await api.template_store.refresh(force=True)
+
+    results = []
+    transport = httpx.ASGITransport(app=api.app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            results.append(
+                await run_load(
+                    "/add-follow/",
+                    lambda i: client.post(
+                        "/add-follow/",
+                        json={"follow_user": f"@api_user{i}", "webhook_url": f"{sink.url}/api-{i}", "notify": "通知"},
+                    ),
+                    args.requests,
+                    args.concurrency,
+                )
+            )
+            results.append(
+                await run_load("/gettemplate", lambda i: client.get("/gettemplate"), args.requests, args.concurrency)
+            )
+            results.append(
+                await run_load(
+                    "/gettemplate?name=",
+                    lambda i: client.get("/gettemplate", params={"name": f"seed{i % args.templates}"}),
+                    args.requests,
+                    args.concurrency,
+                )
+            )
+            # 對照組：沒有請求時的事件迴圈延遲
+            probe = LoopLagProbe()
+            probe.start()
+            await asyncio.sleep(0.5)
+            results.append(await probe.stop("事件迴圈延遲 (閒置)"))
+
+            probe = LoopLagProbe()
+            probe.start()
+            results.append(
+                await run_load(
+                    "/savetemplate",
+                    lambda i: client.post(
+                        "/savetemplate",
+                        json={"filename": f"bench{i}", "cssdata": {"color": "#fff", "i": i}, "ts_token": f"token{i}"},
+                    ),
+                    args.requests,
+                    args.concurrency,
+                )
+            )
+            results.append(await probe.stop("事件迴圈延遲 (/savetemplate 期間)"))
+    finally:
+        shutil.rmtree(template_dir, ignore_errors=True)
+    return results
+
+
+# --- 啟動壓測 ---
+# 在乾淨的子行程中量測，避免受本行程已匯入的模組影響；最後一行輸出 JSON 結果。
+# 匯入計時結束後才替換 DatabasePool.connect，lifespan 不會連到任何資料庫、也不會執行結構遷移
+STARTUP_PROBE = """
+import asyncio, json, sys, time
+start = time.perf_counter()
+import twitter_webhook_api as api
+imported = time.perf_counter()
+
+async def offline_connect(self):
+    return False
+
+api.DatabasePool.connect = offline_connect
+
+async def startup():
+    async with api.app.router.lifespan_context(api.app):
+        return time.perf_counter()
+
+ready = asyncio.run(startup())
+print(json.dumps({"import": imported - start, "ready": ready - start, "tweety": "tweety" in sys.modules}))
+"""
+
+
+def startup_probe_env(role: str) -> Dict[str, str]:
+    """
+    子行程的環境變數：拿掉本行程從 .env 載入的資料庫、Redis 與帳號設定，改成離線值。
+
+    明確設定的值不會被子行程的 load_dotenv 覆蓋；Redis 指向不存在的位址，萬一被用到也只會連線失敗。
+    """
+    env = {
+        key: value
+        for key, value in os.environ.items()
+        if not key.startswith("TWITTER_") and key not in ("username_dict", "error_webhook")
+    }
+    env.update(
+        {
+            "TWITTER_ROLE": role,
+            "TWITTER_DB_HOST": "127.0.0.1",
+            "TWITTER_DB_PORT": "1",
+            "TWITTER_DB_USER": "bench",
+            "TWITTER_DB_PASSWORD": "",
+            "TWITTER_DB_DATABASE": "bench",
+            "TWITTER_REDIS_URL": "redis://127.0.0.1:1/0",
+            "TWITTER_TURNSTILE_MODE": "local",
+            "username_dict": '{"bench": "bench"}',
+            "error_webhook": "",
+        }
+    )
+    return env
+
+
+async def bench_startup(args) -> List[dict]:
+    print(f"🚀 啟動壓測：每種角色 {args.startup_runs} 次")
+    results = []
+    for role in ("api", "both"):
+        import_times: List[float] = []
+        ready_times: List[float] = []
+        loaded = set()
+        errors = 0
+        start = time.perf_counter()
+        for _ in range(args.startup_runs):
+            process = await asyncio.create_subprocess_exec(
+                sys.executable,
+                "-c",
+                STARTUP_PROBE,
+                env=startup_probe_env(role),
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+            stdout, _ = await process.communicate()
+            try:
+                probe = json.loads(stdout.decode().strip().splitlines()[-1])
+            except (IndexError, ValueError):
+                errors += 1
+                continue
+            import_times.append(probe["import"])
+            ready_times.append(probe["ready"])
+            loaded.add(probe["tweety"])
+        elapsed = time.perf_counter() - start
+        results.append(summarize(f"匯入 API 模組 (TWITTER_ROLE={role})", import_times, elapsed, errors))
+        results.append(summarize(f"lifespan 啟動完成 (TWITTER_ROLE={role})", ready_times, elapsed, errors))
+        print(f"   🐦 啟動完成時 tweety 已載入: {'是' if True in loaded else '否'}")
+    return results
+
+
+async def run(args) -> List[dict]:
+    random.seed(args.seed)
+    if args.fake_redis:
+        use_fake_redis()
+    isolate_redis_keys()
+    th.Config.ACCOUNT_LIST = [(f"bench{i}", "bench") for i in range(args.accounts)]
+    th.Config.ACCOUNT_MAX_INFLIGHT = args.inflight
+    th.Config.ACCOUNT_WINDOW_REQUESTS = 10 ** 9  # 壓測不套用時間窗額度
+    th.account_budgets.clear()
+    th.account_pool = th.AccountPool(th.Config.ACCOUNT_LIST)
+
+    await clear_bench_keys()
+    sink = WebhookSink(args.sink_429_rate)
+    await sink.start()
+    db = FakeDatabasePool(args.db_latency)
+    await db.connect()
+
+    results = []
+    try:
+        if not args.skip_startup:
+            results += await bench_startup(args)
+        if not args.skip_poller:
+            results += await bench_poller(args, db, sink)
+        if not args.skip_api:
+            results += await bench_api(args, db, sink)
+    finally:
+        await th.close_http_session()
+        await db.close()
+        await sink.stop()
+        await clear_bench_keys()
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="twitter_webhook 離線壓測")
+    parser.add_argument("--targets", type=int, default=2000, help="監控目標數")
+    parser.add_argument("--subscribers", type=int, default=3, help="每個目標的訂閱數")
+    parser.add_argument("--webhooks", type=int, default=0, help="不同 Webhook 數，0 表示每個訂閱各自獨立")
+    parser.add_argument("--rounds", type=int, default=3, help="輪詢輪數")
+    parser.add_argument("--accounts", type=int, default=10, help="驗證帳號數")
+    parser.add_argument("--broken-accounts", type=int, default=0, help="其中一律回應限流的帳號數，用來測試換帳號重試")
+    parser.add_argument("--inflight", type=int, default=20, help="每個驗證帳號的併發抓取數")
+    parser.add_argument("--twitter-latency", type=float, default=0.05, help="假 Twitter 平均延遲（秒）")
+    parser.add_argument("--new-tweet-rate", type=float, default=0.2, help="每次抓取出現新推文的機率")
+    parser.add_argument("--db-latency", type=float, default=0.001, help="假 MySQL 每次查詢延遲（秒）")
+    parser.add_argument("--sink-429-rate", type=float, default=0.0, help="Webhook 接收端回應 429 的機率")
+    parser.add_argument("--drain-timeout", type=float, default=120, help="等待發送佇列清空的秒數上限")
+    parser.add_argument("--requests", type=int, default=2000, help="每個 API 端點的請求數")
+    parser.add_argument("--concurrency", type=int, default=50, help="API 壓測併發數")
+    parser.add_argument("--templates", type=int, default=200, help="預先建立的模板數")
+    parser.add_argument("--fake-redis", action="store_true", help="改用 fakeredis，不需要 Redis 伺服器")
+    parser.add_argument("--skip-poller", action="store_true")
+    parser.add_argument("--skip-api", action="store_true")
+    parser.add_argument("--skip-startup", action="store_true")
+    parser.add_argument("--startup-runs", type=int, default=5, help="每種角色的啟動量測次數")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="另存結果為 JSON，方便比對不同版本")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = asyncio.run(run(args))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
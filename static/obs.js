@@ -48,6 +48,22 @@ window.FX_REGISTRY = {
         }
     },
 
+    /**
+     * 插入 Script 標籤，載入成功回傳 true
+     */
+    loadScript: function (src) {
+        return new Promise(resolve => {
+            const script = document.createElement('script');
+            script.src = src;
+            script.onload = () => resolve(true);
+            script.onerror = (e) => {
+                console.warn(`無法載入 ${src}`, e);
+                resolve(false);
+            };
+            document.body.appendChild(script);
+        });
+    },
+
     /**
      * 從後端載入所有特效腳本
      */
@@ -58,26 +74,19 @@ window.FX_REGISTRY = {
         container.innerHTML = '<div style="text-align:center; padding:10px; color:#888;">正在載入特效插件...</div>';
 
         try {
-            // 1. 呼叫 API 取得檔案列表
-            const res = await fetch('/fx/list');
-            if (!res.ok) throw new Error("API Error");
-            const files = await res.json();
-
-            // 2. 動態插入 Script 標籤
-            const promises = files.map(file => {
-                return new Promise((resolve, reject) => {
-                    const script = document.createElement('script');
-                    script.src = `static/fx/${file}?t=${new Date().getTime()}`; // 防止快取
-                    script.onload = resolve;
-                    script.onerror = (e) => {
-                        console.warn(`無法載入 ${file}`, e);
-                        resolve(); // 失敗也繼續，不卡流程
-                    };
-                    document.body.appendChild(script);
-                });
-            });
-
-            await Promise.all(promises);
+            // 1. 一次載入合併後的所有特效；頁面提供帶內容雜湊的網址時，瀏覽器可直接使用長期快取
+            const meta = document.querySelector('meta[name="fx-bundle"]');
+            const bundled = await this.loadScript(meta ? meta.content : '/fx/bundle.js');
+
+            // 2. 合併腳本載入失敗，或內容是空的（沒有註冊任何模組）時，改為依清單逐一載入（同樣使用帶版本的網址）
+            if (!bundled || Object.keys(this.modules).length === 0) {
+                const res = await fetch('/fx/manifest');
+                if (!res.ok) throw new Error("API Error");
+                const manifest = await res.json();
+
+                // 失敗也繼續，不卡流程
+                await Promise.all(manifest.files.map(file => this.loadScript(file.url)));
+            }
 
             // 3. 渲染 UI
             this.renderUI(container);
@@ -1,29 +1,60 @@
 import asyncio
+import hashlib
+import heapq
 import json
+import math
 import os
+import random
+import re
+import socket
 import sys
+import time
+import zlib
+from collections import deque
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
-from typing import Dict, List, NamedTuple, Optional, Union
+from typing import TYPE_CHECKING, Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+from uuid import uuid4
 
 import aiohttp
 import aiomysql
 import redis.asyncio as redis
 from dateutil import parser
 from dotenv import load_dotenv
-from tweety import Twitter
-from tweety.exceptions import TwitterError
-from tweety.types import Tweet
+
+from metrics import CONTENT_TYPE, authorized, registry
+
+if TYPE_CHECKING:
+    # tweety 與 aiohttp.web 只有輪詢會用到，執行時延遲匯入（見 tweety_errors / TwitterSessionPool._open）
+    import aiohttp.web
+    from tweety import Twitter
 
 # --- 配置設定 ---
 load_dotenv(dotenv_path="./.env")
 
 
 class Config:
+    # 行程角色：api 只提供 API（可用 uvicorn --workers 擴展），poller 只輪詢，both 兩者都跑
+    ROLE = os.getenv("TWITTER_ROLE", "both").strip().lower()
+    POLLER_ROLES = ("poller", "both")
+    if ROLE not in ("api",) + POLLER_ROLES:
+        # 打錯字時不能默默變成沒有任何行程在輪詢
+        print(f"❌ TWITTER_ROLE 必須是 api、poller 或 both，目前為 {ROLE!r}")
+        sys.exit(1)
+
     DB_HOST = os.getenv("TWITTER_DB_HOST")
     DB_PORT = int(os.getenv("TWITTER_DB_PORT", 3306))
     DB_USER = os.getenv("TWITTER_DB_USER")
     DB_PASSWORD = os.getenv("TWITTER_DB_PASSWORD")
     DB_DATABASE = os.getenv("TWITTER_DB_DATABASE")
+    DB_POOL_MINSIZE = int(os.getenv("TWITTER_DB_POOL_MINSIZE", 1))
+    DB_POOL_MAXSIZE = int(os.getenv("TWITTER_DB_POOL_MAXSIZE", 10))
+    # 連線使用超過此秒數即重建，避免被 MySQL wait_timeout 斷開的舊連線
+    DB_POOL_RECYCLE = int(os.getenv("TWITTER_DB_POOL_RECYCLE", 3600))
+    # 訂閱索引每隔此秒數做一次完整重載，其餘時間只讀取 updated_at 有變動的資料列
+    SUBSCRIPTION_FULL_SYNC_INTERVAL = int(os.getenv("TWITTER_SUBSCRIPTION_FULL_SYNC_INTERVAL", 3600))
+    # 增量同步往回多讀的秒數，涵蓋提交較晚、時間戳較早的交易
+    SUBSCRIPTION_SYNC_OVERLAP = 5
 
     REDIS_URL = os.getenv("TWITTER_REDIS_URL")
     REDIS_MAX_CONNS = int(os.getenv("TWITTER_REDIS_MAX_CONNECTIONS", 10))
@@ -37,6 +68,121 @@ class Config:
         sys.exit(1)
 
     REDIS_KEY_PREFIX = "twitter:last_tweet_time"
+    # 帳號名稱 -> 使用者 ID 快取，讓輪詢不用每次呼叫 get_user_info
+    USER_ID_KEY_PREFIX = "twitter:user_id"
+    USER_ID_CACHE_TTL = int(os.getenv("TWITTER_USER_ID_CACHE_TTL", 7 * 24 * 3600))
+    # 目前啟用中的訂閱數，/add-follow/ 檢查上限時不必掃描資料表
+    SUBSCRIPTION_COUNT_KEY = "twitter:active_subscriptions"
+
+    # 輪詢設定：POLL_INTERVAL 為沒有發文紀錄時的預設間隔，也是統計輸出的週期
+    POLL_INTERVAL = int(os.getenv("TWITTER_POLL_INTERVAL", 900))
+    # 依發文頻率調整的輪詢間隔上下限，間隔 = 預估發文間隔 * POLL_RATE_FACTOR
+    POLL_MIN_INTERVAL = int(os.getenv("TWITTER_POLL_MIN_INTERVAL", 120))
+    POLL_MAX_INTERVAL = int(os.getenv("TWITTER_POLL_MAX_INTERVAL", 3600))
+    POLL_RATE_FACTOR = float(os.getenv("TWITTER_POLL_RATE_FACTOR", 0.25))
+    # 兩輪之間最短等待秒數，讓相近時間到期的目標合併在同一輪處理
+    POLL_TICK = int(os.getenv("TWITTER_POLL_TICK", 10))
+    POST_INTERVAL_KEY = "twitter:post_interval"
+    # 每個驗證帳號同時進行中的抓取數量上限
+    ACCOUNT_MAX_INFLIGHT = int(os.getenv("TWITTER_ACCOUNT_MAX_INFLIGHT", 2))
+    # 每個驗證帳號在 ACCOUNT_WINDOW_SECONDS 內允許的抓取次數
+    ACCOUNT_WINDOW_REQUESTS = int(os.getenv("TWITTER_ACCOUNT_WINDOW_REQUESTS", 50))
+    ACCOUNT_WINDOW_SECONDS = int(os.getenv("TWITTER_ACCOUNT_WINDOW_SECONDS", 900))
+    # 同一目標在一輪內最多換幾個驗證帳號重試
+    ACCOUNT_MAX_ATTEMPTS = int(os.getenv("TWITTER_ACCOUNT_MAX_ATTEMPTS", 3))
+    # 帳號冷卻秒數：被限流且沒有 retry_after 時、登入失效 / 鎖定 / 停權時
+    ACCOUNT_RATE_LIMIT_COOLDOWN = int(os.getenv("TWITTER_ACCOUNT_RATE_LIMIT_COOLDOWN", 900))
+    ACCOUNT_AUTH_COOLDOWN = int(os.getenv("TWITTER_ACCOUNT_AUTH_COOLDOWN", 1800))
+    # 連續發生一般錯誤 ACCOUNT_ERROR_THRESHOLD 次後開始冷卻，之後每次加倍
+    ACCOUNT_ERROR_THRESHOLD = 3
+    ACCOUNT_ERROR_COOLDOWN = int(os.getenv("TWITTER_ACCOUNT_ERROR_COOLDOWN", 60))
+    # 已登入的 Twitter session 閒置超過此秒數即釋放
+    SESSION_IDLE_TIMEOUT = int(os.getenv("TWITTER_SESSION_IDLE_TIMEOUT", 3600))
+
+    # Webhook 發送設定
+    HTTP_MAX_CONNS = int(os.getenv("TWITTER_HTTP_MAX_CONNECTIONS", 100))
+    HTTP_TIMEOUT = int(os.getenv("TWITTER_HTTP_TIMEOUT", 10))
+    WEBHOOK_CONCURRENCY = int(os.getenv("TWITTER_WEBHOOK_CONCURRENCY", 20))
+    WEBHOOK_MAX_ATTEMPTS = int(os.getenv("TWITTER_WEBHOOK_MAX_ATTEMPTS", 5))
+    WEBHOOK_RETRY_BASE = float(os.getenv("TWITTER_WEBHOOK_RETRY_BASE", 2))
+    # 429 與限流延後不計入重試次數，改以排入佇列後的總時間為上限，超過即放棄
+    WEBHOOK_MAX_RETRY_SECONDS = int(os.getenv("TWITTER_WEBHOOK_MAX_RETRY_SECONDS", 3600))
+    # 同一 Webhook 的通知在每輪結束時合併發送：Discord 訊息內容上限 2000 字，
+    # 每則訊息最多放 WEBHOOK_BATCH_MAX_ITEMS 則通知（Discord 每則訊息最多顯示 10 個嵌入預覽）
+    WEBHOOK_CONTENT_LIMIT = 2000
+    WEBHOOK_BATCH_MAX_ITEMS = int(os.getenv("TWITTER_WEBHOOK_BATCH_MAX_ITEMS", 10))
+    WEBHOOK_QUEUE_KEY = "twitter:webhook_queue"
+    WEBHOOK_PROCESSING_KEY = "twitter:webhook_processing"
+    WEBHOOK_DELAYED_KEY = "twitter:webhook_delayed"
+    # 已通過測試訊息的 Webhook 快取，重複訂閱時不再重送測試訊息
+    WEBHOOK_VALID_KEY_PREFIX = "twitter:webhook_valid"
+    WEBHOOK_VALIDATION_TTL = int(os.getenv("TWITTER_WEBHOOK_VALIDATION_TTL", 24 * 3600))
+    # 開啟後 /add-follow/ 先寫入訂閱再於背景驗證 Webhook，驗證失敗時停用
+    WEBHOOK_ASYNC_VALIDATION = os.getenv("TWITTER_WEBHOOK_ASYNC_VALIDATION", "0") == "1"
+
+    # 多 worker 分片輪詢：開啟後每個程序只輪詢自己租到的分片
+    WORKER_MODE = os.getenv("TWITTER_WORKER_MODE", "0") == "1"
+    POLL_SHARDS = int(os.getenv("TWITTER_POLL_SHARDS", 64))
+    SHARD_LEASE_TTL = int(os.getenv("TWITTER_SHARD_LEASE_TTL", 60))
+    SHARD_LEASE_PREFIX = "twitter:shard_lease"
+    WORKER_REGISTRY_KEY = "twitter:workers"
+    # 停機後補抓新推文時最多翻的時間軸頁數，以及翻頁間隔（秒）
+    TIMELINE_MAX_PAGES = int(os.getenv("TWITTER_TIMELINE_MAX_PAGES", 5))
+    TIMELINE_PAGE_WAIT = float(os.getenv("TWITTER_TIMELINE_PAGE_WAIT", 1))
+    # API 新增或停用訂閱時透過此頻道通知所有輪詢程序，不必等下一次資料庫同步
+    SUBSCRIPTION_EVENTS_CHANNEL = "twitter:subscription_events"
+    # 收到事件後稍等片刻再開始一輪，合併短時間內連續的新增
+    SUBSCRIPTION_EVENT_DEBOUNCE = float(os.getenv("TWITTER_SUBSCRIPTION_EVENT_DEBOUNCE", 1))
+
+    # 獨立執行輪詢時提供 /metrics 的埠號，0 代表不開啟（與 API 同程序時由 API 提供）
+    METRICS_PORT = int(os.getenv("TWITTER_METRICS_PORT", 0))
+    # 讀取 /metrics 需帶 Authorization: Bearer <token>；API 未設定時不提供 /metrics（API 經由通道對外公開）
+    METRICS_TOKEN = os.getenv("TWITTER_METRICS_TOKEN", "")
+    # 開啟後每輪與統計週期額外輸出一行 JSON 日誌
+    LOG_JSON = os.getenv("TWITTER_LOG_JSON", "0") == "1"
+
+
+# --- 監控指標 ---
+POLL_STAGE_SECONDS = registry.histogram(
+    "twitter_poll_stage_seconds", "process_user_tasks 各階段耗時", ("stage",)
+)
+FETCH_TOTAL = registry.counter("twitter_fetch_total", "Twitter 抓取次數，依帳號與結果分類", ("account", "result"))
+TIMELINE_PAGES_TOTAL = registry.counter("twitter_timeline_pages_total", "抓取的時間軸頁數")
+NEW_TWEETS_TOTAL = registry.counter("twitter_new_tweets_total", "發現並推送的新推文數")
+SUBSCRIPTION_SYNC_SECONDS = registry.histogram("twitter_subscription_sync_seconds", "訂閱索引同步耗時")
+ROUND_SECONDS = registry.histogram(
+    "twitter_poll_round_seconds", "一輪輪詢耗時", buckets=(1, 5, 10, 30, 60, 120, 300, 600, 900, 1800)
+)
+ROUND_BUDGET_SECONDS = registry.gauge("twitter_poll_round_budget_seconds", "一輪輪詢應在此秒數內完成")
+ROUND_BUDGET_SECONDS.set(Config.POLL_MIN_INTERVAL)
+MONITORED_TARGETS = registry.gauge("twitter_monitored_targets", "本程序負責的監控目標數")
+DUE_TARGETS = registry.gauge("twitter_due_targets", "上一輪到期的目標數")
+NOTIFY_DELAY_SECONDS = registry.histogram(
+    "twitter_notify_delay_seconds",
+    "推文發布到加入發送佇列的延遲",
+    buckets=(30, 60, 120, 300, 600, 900, 1800, 3600, 7200),
+)
+WEBHOOK_TOTAL = registry.counter("twitter_webhook_total", "Webhook 發送結果", ("result",))
+WEBHOOK_BATCHED_TOTAL = registry.counter("twitter_webhook_batched_total", "因合併發送而省下的 Webhook 請求數")
+WEBHOOK_SECONDS = registry.histogram("twitter_webhook_seconds", "單次 Webhook 請求耗時")
+ACCOUNT_SUCCESS_RATE = registry.gauge(
+    "twitter_account_success_rate", "驗證帳號的抓取成功率 (EWMA)，account 為帳號名稱的雜湊", ("account",)
+)
+ACCOUNT_COOLDOWNS_TOTAL = registry.counter(
+    "twitter_account_cooldowns_total", "驗證帳號進入冷卻的次數", ("account", "reason")
+)
+
+
+def account_label(auth_user: str) -> str:
+    """指標標籤不放驗證帳號名稱，改用穩定的短雜湊"""
+    return hashlib.sha256(auth_user.encode("utf-8")).hexdigest()[:8]
+
+
+DB_ACQUIRE_WAIT_SECONDS = registry.histogram(
+    "twitter_db_acquire_wait_seconds",
+    "從連線池取得 MySQL 連線的等待時間",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+)
 
 
 # --- 資料結構 ---
@@ -52,159 +198,1710 @@ class TweetResult(NamedTuple):
     created_at: datetime
 
 
+class WebhookResult(NamedTuple):
+    status: int  # 0 代表連線失敗
+    retry_after: float  # 伺服器要求的等待秒數
+
+
 class UserNotFoundError(Exception):
     """當 Twitter 用戶不存在或鎖定時拋出"""
 
     pass
 
 
+class AccountBudget:
+    """單一驗證帳號的併發上限、時間窗請求額度與健康狀態"""
+
+    HEALTH_ALPHA = 0.2  # 成功率與延遲 EWMA 的權重
+
+    def __init__(self, auth_user: str, max_inflight: int, window_requests: int, window_seconds: int):
+        self.auth_user = auth_user
+        self.label = account_label(auth_user)
+        self.max_inflight = max_inflight
+        self.window_requests = window_requests
+        self.window_seconds = window_seconds
+        self._semaphore = asyncio.Semaphore(max_inflight)
+        self._window_lock = asyncio.Lock()
+        self._sent = deque()  # 時間窗內每次請求的開始時間
+        self.inflight = 0  # 排隊中與進行中的抓取數
+
+        # 健康狀態（跨輪次保留）
+        self.success_rate = 1.0
+        self.latency = 0.0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+
+        # 每輪統計
+        self.requests = 0
+        self.failures = 0
+        self.busy_time = 0.0
+
+    def reset_stats(self):
+        self.requests = 0
+        self.failures = 0
+        self.busy_time = 0.0
+
+    def record_success(self, latency: float):
+        alpha = self.HEALTH_ALPHA
+        self.success_rate = alpha + (1 - alpha) * self.success_rate
+        self.latency = latency if self.latency == 0 else alpha * latency + (1 - alpha) * self.latency
+        self.consecutive_failures = 0
+        ACCOUNT_SUCCESS_RATE.set(round(self.success_rate, 3), account=self.label)
+
+    def record_failure(self, cooldown: float, reason: str):
+        self.success_rate = (1 - self.HEALTH_ALPHA) * self.success_rate
+        self.consecutive_failures += 1
+        self.failures += 1
+        ACCOUNT_SUCCESS_RATE.set(round(self.success_rate, 3), account=self.label)
+        if cooldown > 0:
+            self.cooldown_until = max(self.cooldown_until, time.monotonic() + cooldown)
+            ACCOUNT_COOLDOWNS_TOTAL.inc(account=self.label, reason=reason)
+
+    def cooldown_remaining(self, now: float) -> float:
+        return max(0.0, self.cooldown_until - now)
+
+    def has_capacity(self, now: float) -> bool:
+        """有空閒併發名額，且時間窗內還有額度"""
+        if self.inflight >= self.max_inflight:
+            return False
+        in_window = sum(1 for sent_at in self._sent if now - sent_at < self.window_seconds)
+        return in_window < self.window_requests
+
+    async def _wait_for_window(self):
+        """等待時間窗內有剩餘額度，並登記本次請求"""
+        async with self._window_lock:
+            while True:
+                now = time.monotonic()
+                while self._sent and now - self._sent[0] >= self.window_seconds:
+                    self._sent.popleft()
+                if len(self._sent) < self.window_requests:
+                    self._sent.append(now)
+                    return
+                await asyncio.sleep(self.window_seconds - (now - self._sent[0]))
+
+    @asynccontextmanager
+    async def slot(self):
+        """取得一個抓取名額，離開時記錄佔用時間"""
+        self.inflight += 1
+        try:
+            async with self._semaphore:
+                await self._wait_for_window()
+                start = time.monotonic()
+                try:
+                    yield
+                finally:
+                    self.requests += 1
+                    self.busy_time += time.monotonic() - start
+        finally:
+            self.inflight -= 1
+
+    def utilization(self, wall_time: float) -> float:
+        """本輪佔用時間相對於可用併發時間的比例"""
+        if wall_time <= 0:
+            return 0.0
+        return self.busy_time / (wall_time * self.max_inflight)
+
+
+# 跨輪次保留，時間窗額度才不會在每輪開始時被重置
+account_budgets: Dict[str, AccountBudget] = {}
+
+
+def get_account_budget(auth_user: str) -> AccountBudget:
+    budget = account_budgets.get(auth_user)
+    if budget is None:
+        budget = AccountBudget(
+            auth_user,
+            max_inflight=Config.ACCOUNT_MAX_INFLIGHT,
+            window_requests=Config.ACCOUNT_WINDOW_REQUESTS,
+            window_seconds=Config.ACCOUNT_WINDOW_SECONDS,
+        )
+        account_budgets[auth_user] = budget
+    return budget
+
+
+class AccountPool:
+    """依健康狀態分配驗證帳號：挑選未冷卻、有空閒額度且成功率最高的帳號，負載相近時選較空閒者"""
+
+    def __init__(self, accounts: List[Tuple[str, str]]):
+        self.passwords: Dict[str, str] = dict(accounts)
+
+    def pick(self, exclude: Iterable[str] = ()) -> Optional[AccountBudget]:
+        """回傳最適合的帳號；全部冷卻中（或已試過）時回傳 None"""
+        now = time.monotonic()
+        candidates = [
+            get_account_budget(auth_user)
+            for auth_user in self.passwords
+            if auth_user not in exclude
+        ]
+        candidates = [budget for budget in candidates if budget.cooldown_remaining(now) == 0]
+        if not candidates:
+            return None
+        return min(
+            candidates,
+            key=lambda budget: (
+                not budget.has_capacity(now),
+                -round(budget.success_rate, 1),
+                budget.inflight / budget.max_inflight,
+                budget.latency,
+            ),
+        )
+
+    @staticmethod
+    def is_account_error(error: Exception) -> bool:
+        """
+        限流、驗證失敗、連線錯誤與 Twitter 端 5xx 走帳號冷卻並換帳號重試；其餘錯誤與帳號無關。
+
+        5xx 多半是暫時性的，依 ACCOUNT_ERROR_THRESHOLD 連續失敗後才冷卻，不會誤判成目標不存在。
+        """
+        import httpx
+
+        errors = tweety_errors()
+        return is_server_error(error) or isinstance(
+            error,
+            TwitterSessionPool.auth_errors()
+            + (
+                errors.RateLimitReached,
+                errors.LockedAccount,
+                errors.SuspendedAccount,
+                httpx.TransportError,
+                asyncio.TimeoutError,
+                OSError,
+            ),
+        )
+
+    def cooldown_for(self, budget: AccountBudget, error: Exception) -> Tuple[float, str]:
+        """依錯誤類型決定帳號冷卻秒數與原因"""
+        errors = tweety_errors()
+        if isinstance(error, errors.RateLimitReached):
+            retry_after = getattr(error, "retry_after", None)
+            return float(retry_after or Config.ACCOUNT_RATE_LIMIT_COOLDOWN), "rate_limit"
+        if isinstance(error, TwitterSessionPool.auth_errors() + (errors.LockedAccount, errors.SuspendedAccount)):
+            # 重新登入後仍失敗，或帳號被鎖定 / 停權；由呼叫端丟棄該帳號的 session
+            return float(Config.ACCOUNT_AUTH_COOLDOWN), "auth"
+        failures = budget.consecutive_failures + 1
+        if failures < Config.ACCOUNT_ERROR_THRESHOLD:
+            return 0.0, "error"
+        cooldown = Config.ACCOUNT_ERROR_COOLDOWN * 2 ** (failures - Config.ACCOUNT_ERROR_THRESHOLD)
+        return float(min(cooldown, Config.ACCOUNT_AUTH_COOLDOWN)), "error"
+
+
+def tweety_errors():
+    """延遲匯入 tweety 的例外模組：只跑 API 的行程不會載入 tweety（約佔本模組匯入時間的四成）"""
+    import tweety.exceptions
+
+    return tweety.exceptions
+
+
+# Twitter 回報「監控目標本身」不存在、停權或無法存取時的錯誤碼與名稱
+TARGET_ERROR_CODES = (50, 63)  # GenericUserNotFound, OtherUserSuspended
+TARGET_ERROR_NAMES = ("GenericUserNotFound", "OtherUserSuspended", "UserUnavailable", "UserSuspended")
+
+
+def is_server_error(error: Exception) -> bool:
+    """Twitter 端的 5xx 或 tweety 的 Server Error：暫時性錯誤，稍後或換帳號重試"""
+    if not isinstance(error, tweety_errors().TwitterError):
+        return False
+    if getattr(error, "error_name", None) == "Server Error":
+        return True
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status, int) and status >= 500:
+        return True
+    try:
+        return int(getattr(error, "error_code", 0)) >= 500
+    except (TypeError, ValueError):
+        return False
+
+
+def is_target_unavailable(error: Exception) -> bool:
+    """錯誤是否來自監控目標本身（不存在、受保護或停權），而不是驗證帳號、連線或 Twitter 端故障"""
+    errors = tweety_errors()
+    account_errors = TwitterSessionPool.auth_errors() + (
+        errors.RateLimitReached,
+        errors.LockedAccount,
+        errors.SuspendedAccount,
+    )
+    if not isinstance(error, errors.TwitterError) or isinstance(error, account_errors) or is_server_error(error):
+        return False
+    target_errors = tuple(getattr(errors, name) for name in ("UserNotFound", "UserProtected") if hasattr(errors, name))
+    if isinstance(error, target_errors):
+        return True
+    if getattr(error, "error_name", None) in TARGET_ERROR_NAMES:
+        return True
+    try:
+        if int(getattr(error, "error_code", 0)) in TARGET_ERROR_CODES:
+            return True
+    except (TypeError, ValueError):
+        pass
+    # 舊版 tweety 只拋出 TwitterError：沿用 tweety 固定的錯誤訊息判斷
+    message = str(error)
+    return "User Account wasn't Found" in message or "Protected" in message
+
+
+class TwitterSessionPool:
+    """依驗證帳號保存已登入的 tweety 客戶端，跨目標與跨輪次重用"""
+
+    def __init__(self, idle_timeout: int):
+        self.idle_timeout = idle_timeout
+        self._sessions: Dict[str, "Twitter"] = {}
+        self._last_used: Dict[str, float] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    @staticmethod
+    def auth_errors() -> tuple:
+        """代表 session 已失效、需要重新登入的錯誤"""
+        errors = tweety_errors()
+        return (errors.InvalidCredentials, errors.AuthenticationRequired)
+
+    @staticmethod
+    def _is_healthy(app: "Twitter") -> bool:
+        return bool(getattr(app, "is_user_authorized", False))
+
+    async def _open(self, auth_user: str, auth_pass: str) -> "Twitter":
+        from tweety import Twitter
+
+        app = Twitter(f".twitter_token/{auth_user}")
+        # sign_in 會優先沿用磁碟上的 session，失效時才走完整登入流程
+        await app.sign_in(username=auth_user, password=auth_pass)
+        if not self._is_healthy(app):
+            await app.connect()
+        print(f"🔑 帳號 {auth_user} 登入完成")
+        return app
+
+    async def get(self, auth_user: str, auth_pass: str) -> "Twitter":
+        """取得該帳號已連線的客戶端，必要時才重新登入"""
+        lock = self._locks.setdefault(auth_user, asyncio.Lock())
+        async with lock:
+            app = self._sessions.get(auth_user)
+            if app is None or not self._is_healthy(app):
+                if app is not None:
+                    await self._close(app)
+                app = await self._open(auth_user, auth_pass)
+                self._sessions[auth_user] = app
+            self._last_used[auth_user] = time.monotonic()
+            return app
+
+    @staticmethod
+    async def _close(app: "Twitter"):
+        # tweety 的 Request 底下是一個 httpx.AsyncClient，丟棄客戶端前先關閉，避免連線洩漏
+        session = getattr(getattr(app, "request", None), "session", None)
+        if session is None:
+            return
+        try:
+            await session.aclose()
+        except Exception as e:
+            print(f"⚠️ 關閉 tweety 連線失敗: {e}")
+
+    async def invalidate(self, auth_user: str):
+        """驗證失敗時丟棄該帳號的 session，下次取用時重新登入"""
+        app = self._sessions.pop(auth_user, None)
+        self._last_used.pop(auth_user, None)
+        if app is not None:
+            await self._close(app)
+
+    async def evict_idle(self):
+        now = time.monotonic()
+        for auth_user, last_used in list(self._last_used.items()):
+            if now - last_used > self.idle_timeout:
+                print(f"🧹 釋放閒置的帳號 session: {auth_user}")
+                await self.invalidate(auth_user)
+
+    async def close_all(self):
+        for auth_user in list(self._sessions):
+            await self.invalidate(auth_user)
+
+
+class DeliveryStats:
+    """每輪 Webhook 發送統計"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.sent = 0
+        self.failed = 0
+        self.rate_limited = 0
+        self.retried = 0
+        self.latencies: List[float] = []
+
+    def record(self, success: bool, elapsed: float):
+        if success:
+            self.sent += 1
+        else:
+            self.failed += 1
+        self.latencies.append(elapsed)
+
+    def percentile(self, q: float) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+delivery_stats = DeliveryStats()
+
+
+class WebhookRateLimiter:
+    """依 Discord 回應標頭追蹤每個 Webhook 的限流桶"""
+
+    def __init__(self):
+        self._buckets: Dict[str, List[float]] = {}  # url -> [剩餘次數, 重置時間]
+        self._global_reset_at = 0.0
+
+    def acquire(self, url: str) -> float:
+        """回傳需等待的秒數；可立即發送時先預扣一次額度"""
+        now = time.monotonic()
+        wait = max(0.0, self._global_reset_at - now)
+        bucket = self._buckets.get(url)
+        if bucket is not None:
+            remaining, reset_at = bucket
+            if now >= reset_at:
+                del self._buckets[url]
+            elif remaining <= 0:
+                wait = max(wait, reset_at - now)
+            elif wait == 0:
+                bucket[0] -= 1
+        return wait
+
+    def update(self, url: str, headers):
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset_after = headers.get("X-RateLimit-Reset-After")
+        if remaining is not None and reset_after is not None:
+            self._buckets[url] = [int(remaining), time.monotonic() + float(reset_after)]
+
+    def block(self, url: str, retry_after: float, is_global: bool):
+        until = time.monotonic() + retry_after
+        if is_global:
+            self._global_reset_at = max(self._global_reset_at, until)
+        else:
+            self._buckets[url] = [0, until]
+
+
+class PollScheduler:
+    """依各目標發文頻率排定下次輪詢時間的優先佇列"""
+
+    EWMA_ALPHA = 0.3
+
+    def __init__(self, min_interval: int, max_interval: int, default_interval: int, rate_factor: float):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.default_interval = default_interval
+        self.rate_factor = rate_factor
+        self._heap: List[Tuple[float, str]] = []
+        self._next_poll: Dict[str, float] = {}
+        self.post_intervals: Dict[str, float] = {}  # 平均發文間隔 (EWMA 秒)
+
+        # 統計
+        self.polls = 0
+        self.notify_delays: List[float] = []
+
+    def reset_stats(self):
+        self.polls = 0
+        self.notify_delays = []
+
+    def sync(self, targets: Iterable[str]):
+        """新目標立即排入，已移除的目標從排程中剔除"""
+        targets = set(targets)
+        now = time.time()
+        for target_user in targets:
+            if target_user not in self._next_poll:
+                self.schedule(target_user, now)
+        for target_user in list(self._next_poll):
+            if target_user not in targets:
+                del self._next_poll[target_user]
+
+    def schedule(self, target_user: str, at: float):
+        self._next_poll[target_user] = at
+        heapq.heappush(self._heap, (at, target_user))
+
+    def is_scheduled(self, target_user: str) -> bool:
+        return target_user in self._next_poll
+
+    def discard(self, target_user: str):
+        # heap 中的舊紀錄由 _discard_stale 略過
+        self._next_poll.pop(target_user, None)
+
+    def _discard_stale(self):
+        # 重新排程或已移除的目標在 heap 中留有舊紀錄，取出時略過
+        while self._heap and self._next_poll.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    def next_due(self) -> Optional[float]:
+        self._discard_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: float) -> List[str]:
+        due = []
+        self._discard_stale()
+        while self._heap and self._heap[0][0] <= now:
+            _, target_user = heapq.heappop(self._heap)
+            del self._next_poll[target_user]
+            due.append(target_user)
+            self._discard_stale()
+        return due
+
+    def observe_tweet(self, target_user: str, previous_ts: int, tweet_ts: int) -> float:
+        """以新舊推文的時間差更新平均發文間隔"""
+        gap = max(tweet_ts - previous_ts, 0)
+        current = self.post_intervals.get(target_user)
+        ewma = gap if current is None else self.EWMA_ALPHA * gap + (1 - self.EWMA_ALPHA) * current
+        self.post_intervals[target_user] = ewma
+        return ewma
+
+    def interval_for(self, target_user: str, last_tweet_ts: Optional[int], now: float) -> float:
+        """預估發文間隔取平均間隔與距上次發文時間的較大者，沉寂的帳號會逐漸降低輪詢頻率"""
+        post_interval = self.post_intervals.get(target_user)
+        if last_tweet_ts is None and post_interval is None:
+            return self.default_interval
+        expected_gap = max(post_interval or 0, now - last_tweet_ts if last_tweet_ts else 0)
+        return min(max(expected_gap * self.rate_factor, self.min_interval), self.max_interval)
+
+
+poll_scheduler = PollScheduler(
+    min_interval=Config.POLL_MIN_INTERVAL,
+    max_interval=Config.POLL_MAX_INTERVAL,
+    default_interval=Config.POLL_INTERVAL,
+    rate_factor=Config.POLL_RATE_FACTOR,
+)
+
+
 # --- 全域連線池 ---
-redis_pool = redis.ConnectionPool.from_url(Config.REDIS_URL, max_connections=Config.REDIS_MAX_CONNS)
+# 發送佇列的每個 worker 以 BRPOPLPUSH 長時間佔用一條連線，另外保留；連線用完時排隊等待而不是直接拋錯
+redis_pool = redis.BlockingConnectionPool.from_url(
+    Config.REDIS_URL, max_connections=Config.REDIS_MAX_CONNS + Config.WEBHOOK_CONCURRENCY
+)
 redis_client = redis.Redis(connection_pool=redis_pool)
+twitter_sessions = TwitterSessionPool(idle_timeout=Config.SESSION_IDLE_TIMEOUT)
+account_pool = AccountPool(Config.ACCOUNT_LIST)
 
+# HTTP 連線池與 Webhook 併發上限，需在事件迴圈內才建立
+_http_session: Optional[aiohttp.ClientSession] = None
+_webhook_semaphore: Optional[asyncio.Semaphore] = None
 
-# --- 資料庫操作 ---
-async def create_db_pool():
-    try:
-        pool = await aiomysql.create_pool(
-            host=Config.DB_HOST,
-            port=Config.DB_PORT,
-            user=Config.DB_USER,
-            password=Config.DB_PASSWORD,
-            db=Config.DB_DATABASE,
-            minsize=1,
-            maxsize=10,
-            charset="utf8mb4",
-            autocommit=True,
+
+def get_http_session() -> aiohttp.ClientSession:
+    """取得整個程序共用的 HTTP 連線池"""
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        _http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=Config.HTTP_MAX_CONNS),
+            timeout=aiohttp.ClientTimeout(total=Config.HTTP_TIMEOUT),
         )
-        print("✅ 資料庫連線池建立成功")
-        return pool
-    except Exception as e:
-        print(f"❌ 資料庫連線失敗: {e}")
-        return None
+    return _http_session
+
+
+async def close_http_session():
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
+
+
+def get_webhook_semaphore() -> asyncio.Semaphore:
+    global _webhook_semaphore
+    if _webhook_semaphore is None:
+        _webhook_semaphore = asyncio.Semaphore(Config.WEBHOOK_CONCURRENCY)
+    return _webhook_semaphore
+
+
+# --- Worker 分片租約 ---
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:6]}"
+
+_RENEW_LEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+_RELEASE_LEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+renew_lease_script = redis_client.register_script(_RENEW_LEASE_LUA)
+release_lease_script = redis_client.register_script(_RELEASE_LEASE_LUA)
+
+
+async def heartbeat_worker():
+    """在 worker 名單登記存活時間，並清掉逾時未回報的 worker"""
+    now = time.time()
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.zadd(Config.WORKER_REGISTRY_KEY, {WORKER_ID: now})
+    pipe.zremrangebyscore(Config.WORKER_REGISTRY_KEY, "-inf", now - Config.SHARD_LEASE_TTL)
+    await pipe.execute()
+
+
+async def live_workers() -> set:
+    now = time.time()
+    members = await redis_client.zrangebyscore(
+        Config.WORKER_REGISTRY_KEY, now - Config.SHARD_LEASE_TTL, "+inf"
+    )
+    return {member.decode("utf-8") for member in members}
+
+
+def shard_of(target_user: str) -> int:
+    return zlib.crc32(target_user.lower().encode("utf-8")) % Config.POLL_SHARDS
+
+
+class ShardLeaseManager:
+    """以 Redis 租約分配輪詢分片，讓多個 worker 各自負責不重疊的目標"""
+
+    def __init__(self, shards: int, lease_ttl: int):
+        self.shards = shards
+        self.lease_ttl = lease_ttl
+        self.owned: set = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def owns(self, target_user: str) -> bool:
+        return shard_of(target_user) in self.owned
 
+    @staticmethod
+    def _lease_key(shard: int) -> str:
+        return f"{Config.SHARD_LEASE_PREFIX}:{shard}"
 
-async def fetch_active_tasks(pool) -> Dict[str, List[FollowTask]]:
-    """獲取任務並按用戶分組"""
+    async def sync(self):
+        """續約、依存活 worker 數量釋出多餘分片，並接手無人持有的分片"""
+        await heartbeat_worker()
+        quota = math.ceil(self.shards / max(len(await live_workers()), 1))
+        ttl_ms = self.lease_ttl * 1000
+
+        for shard in list(self.owned):
+            if not await renew_lease_script(keys=[self._lease_key(shard)], args=[WORKER_ID, ttl_ms]):
+                self.owned.discard(shard)
+
+        while len(self.owned) > quota:
+            shard = self.owned.pop()
+            await release_lease_script(keys=[self._lease_key(shard)], args=[WORKER_ID])
+
+        if len(self.owned) < quota:
+            free = [shard for shard in range(self.shards) if shard not in self.owned]
+            random.shuffle(free)
+            for shard in free:
+                if await redis_client.set(self._lease_key(shard), WORKER_ID, nx=True, px=ttl_ms):
+                    self.owned.add(shard)
+                    if len(self.owned) >= quota:
+                        break
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.lease_ttl / 3)
+            try:
+                await self.sync()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # 續約失敗時先放掉所有分片，避免租約過期後與其他 worker 重複輪詢
+                print(f"❌ 分片租約更新失敗: {e}")
+                self.owned.clear()
+
+    async def start(self):
+        if self._task is None:
+            await self.sync()
+            self._task = asyncio.create_task(self._run())
+            print(f"🧩 Worker {WORKER_ID} 取得 {len(self.owned)}/{self.shards} 個分片")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for shard in self.owned:
+            await release_lease_script(keys=[self._lease_key(shard)], args=[WORKER_ID])
+        self.owned.clear()
+        await redis_client.zrem(Config.WORKER_REGISTRY_KEY, WORKER_ID)
+
+
+shard_leases = ShardLeaseManager(shards=Config.POLL_SHARDS, lease_ttl=Config.SHARD_LEASE_TTL)
+
+
+# --- 資料庫操作 ---
+class DatabasePool:
+    """長駐的 MySQL 連線池：供 API 與輪詢共用，失效時自動重建，並記錄取得連線的等待時間"""
+
+    # 連線池不存在時，acquire 最多每隔此秒數嘗試重建一次，資料庫停機時不會每個請求都去連線
+    RECONNECT_INTERVAL = 5
+
+    def __init__(self):
+        self._pool = None
+        self._reconnect_lock = asyncio.Lock()
+        self._reconnect_at = 0.0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.acquires = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    async def connect(self) -> bool:
+        try:
+            self._pool = await aiomysql.create_pool(
+                host=Config.DB_HOST,
+                port=Config.DB_PORT,
+                user=Config.DB_USER,
+                password=Config.DB_PASSWORD,
+                db=Config.DB_DATABASE,
+                minsize=Config.DB_POOL_MINSIZE,
+                maxsize=Config.DB_POOL_MAXSIZE,
+                pool_recycle=Config.DB_POOL_RECYCLE,
+                charset="utf8mb4",
+                autocommit=True,
+            )
+            print("✅ 資料庫連線池建立成功")
+            return True
+        except Exception as e:
+            print(f"❌ 資料庫連線失敗: {e}")
+            self._pool = None
+            return False
+
+    async def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            await self._pool.wait_closed()
+            self._pool = None
+
+    async def _ensure_pool(self):
+        """啟動時資料庫未就緒或連線池已關閉時，在取用連線時重建"""
+        async with self._reconnect_lock:
+            if self._pool is not None or time.monotonic() < self._reconnect_at:
+                return
+            self._reconnect_at = time.monotonic() + self.RECONNECT_INTERVAL
+            await self.connect()
+
+    @asynccontextmanager
+    async def acquire(self):
+        if self._pool is None:
+            await self._ensure_pool()
+            if self._pool is None:
+                raise RuntimeError("資料庫連線池尚未建立")
+        start = time.monotonic()
+        async with self._pool.acquire() as conn:
+            wait = time.monotonic() - start
+            self.acquires += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            DB_ACQUIRE_WAIT_SECONDS.observe(wait)
+            yield conn
+
+    async def health_check(self) -> bool:
+        """執行 SELECT 1 確認連線正常，失敗時重建連線池"""
+        if self._pool is not None:
+            try:
+                async with self.acquire() as conn:
+                    async with conn.cursor() as cursor:
+                        await cursor.execute("SELECT 1")
+                return True
+            except Exception as e:
+                print(f"⚠️ 資料庫健康檢查失敗，重新建立連線池: {e}")
+
+        async with self._reconnect_lock:
+            await self.close()
+            return await self.connect()
+
+
+# Twitter 帳號名稱只允許英數字與底線，且不分大小寫
+TWITTER_HANDLE_PATTERN = re.compile(r"^[a-z0-9_]{1,15}$")
+
+
+def canonical_target(follow_user: str) -> str:
+    """把使用者輸入的帳號名稱正規化為唯一的監控鍵：去掉空白與 @，並轉為小寫"""
+    return follow_user.replace("@", "").strip().lower()
+
+
+def is_valid_target(target_user: str) -> bool:
+    return bool(TWITTER_HANDLE_PATTERN.match(target_user))
+
+
+async def canonicalize_follow_users(pool) -> int:
+    """
+    將既有訂閱的 follow_user 一次改寫為正規化後的名稱，回傳改寫的資料列數。
+
+    正規化後與既有訂閱重複（同帳號同 Webhook）的資料列無法改名。重複的一方仍啟用時，先啟用正規化的那筆，
+    再停用重複的資料列，避免正規化的那筆早已停用時訂閱者失去唯一的訂閱。
+    以 BINARY 比較，避免不分大小寫的定序把 GawrGura 與 gawrgura 視為相同而略過。
+    """
+    canonical = "LOWER(TRIM(REPLACE(follow_user, '@', '')))"
+    merged = disabled = 0
     async with pool.acquire() as conn:
         async with conn.cursor() as cursor:
             await cursor.execute(
-                "SELECT id, follow_user, webhook_url, notify FROM follow_data WHERE state = 1"
+                f"UPDATE IGNORE follow_data SET follow_user = {canonical} "
+                f"WHERE BINARY follow_user <> BINARY {canonical}"
             )
-            rows = await cursor.fetchall()
+            renamed = cursor.rowcount
+            await cursor.execute(
+                f"SELECT id, follow_user, {canonical}, webhook_url FROM follow_data "
+                f"WHERE state = 1 AND BINARY follow_user <> BINARY {canonical}"
+            )
+            for task_id, follow_user, target_user, webhook_url in await cursor.fetchall():
+                await cursor.execute(
+                    "UPDATE follow_data SET state = 1 "
+                    "WHERE BINARY follow_user = BINARY %s AND webhook_url = %s AND state = 0",
+                    (target_user, webhook_url),
+                )
+                if cursor.rowcount:
+                    merged += 1
+                    print(f"🛠️ 重新啟用 {target_user} → {webhook_url}，取代重複訂閱 #{task_id} ({follow_user})")
+                await cursor.execute("UPDATE follow_data SET state = 0 WHERE id = %s AND state = 1", (task_id,))
+                disabled += cursor.rowcount
+                print(f"🛠️ 停用重複訂閱 #{task_id} ({follow_user} → {webhook_url})")
+    if renamed or disabled:
+        print(f"🛠️ follow_data 正規化帳號名稱 {renamed} 筆，合併重複訂閱 {merged} 筆，停用 {disabled} 筆")
+    if disabled > merged:
+        # 啟用中的訂閱數減少了，讓名額計數器下次使用時從資料庫重算
+        await redis_client.delete(Config.SUBSCRIPTION_COUNT_KEY)
+    return renamed
+
+
+async def canonicalize_target_state():
+    """把 Redis 中以原始名稱記錄的最新推文時間與發文間隔合併到正規化後的名稱"""
+    for key, merge in ((Config.REDIS_KEY_PREFIX, max), (Config.POST_INTERVAL_KEY, min)):
+        values = await redis_client.hgetall(key)
+        merged: Dict[str, bytes] = {}
+        stale = []
+        for field, value in values.items():
+            name = field.decode("utf-8")
+            target_user = canonical_target(name)
+            if target_user == name:
+                continue
+            stale.append(field)
+            current = merged.get(target_user, values.get(target_user.encode("utf-8")))
+            if current is None:
+                merged[target_user] = value
+            elif key == Config.REDIS_KEY_PREFIX:
+                # 最新推文時間取較新者；舊格式 (ISO 字串) 交給 _parse_cached_time 解析
+                parsed = [(_parse_cached_time(v) or 0, v) for v in (current, value)]
+                merged[target_user] = merge(parsed)[1]
+            else:
+                merged[target_user] = merge(current, value, key=float)
+        if stale:
+            pipe = redis_client.pipeline(transaction=True)
+            pipe.hset(key, mapping=merged)
+            pipe.hdel(key, *stale)
+            await pipe.execute()
+
+
+# 多個行程同時遷移時，輸家會遇到的錯誤：欄位 / 索引已存在、等鎖逾時、死結
+SCHEMA_RACE_ERRORS = (1060, 1061, 1205, 1213)
+
+
+async def _alter_follow_data(cursor, sql: str):
+    try:
+        await cursor.execute(sql)
+    except aiomysql.MySQLError as e:
+        if not e.args or e.args[0] not in SCHEMA_RACE_ERRORS:
+            raise
+        print(f"ℹ️ follow_data 結構已由其他行程更新，略過: {e}")
 
-            # 將資料轉換為物件並分組
-            grouped = {}
-            for row in rows:
-                task = FollowTask(
-                    id=row[0], follow_user=row[1], webhook_url=row[2], notify_msg=row[3]
+
+async def ensure_follow_data_schema(pool):
+    """補上增量同步需要的 updated_at 欄位，讓 id 改由 AUTO_INCREMENT 配發，並正規化既有的帳號名稱"""
+    async with pool.acquire() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute("SHOW COLUMNS FROM follow_data LIKE 'updated_at'")
+            if not await cursor.fetchone():
+                print("🛠️ follow_data 新增 updated_at 欄位")
+                await _alter_follow_data(
+                    cursor,
+                    """
+                    ALTER TABLE follow_data
+                    ADD COLUMN updated_at TIMESTAMP(3) NOT NULL
+                        DEFAULT CURRENT_TIMESTAMP(3) ON UPDATE CURRENT_TIMESTAMP(3),
+                    ADD INDEX idx_follow_data_updated_at (updated_at)
+                    """
                 )
-                if task.follow_user not in grouped:
-                    grouped[task.follow_user] = []
-                grouped[task.follow_user].append(task)
-            return grouped
+
+            await cursor.execute("SHOW COLUMNS FROM follow_data LIKE 'id'")
+            column = await cursor.fetchone()
+            # SHOW COLUMNS 欄位順序: Field, Type, Null, Key, Default, Extra
+            if column and "auto_increment" not in column[5].lower():
+                print("🛠️ follow_data.id 改為 AUTO_INCREMENT")
+                await _alter_follow_data(cursor, f"ALTER TABLE follow_data MODIFY id {column[1]} NOT NULL AUTO_INCREMENT")
+
+    await canonicalize_follow_users(pool)
+    await canonicalize_target_state()
+
+
+class SubscriptionIndex:
+    """以正規化後的 follow_user 為鍵的訂閱索引：完整載入一次，之後只套用 updated_at 有變動的資料列"""
+
+    def __init__(self):
+        self.grouped: Dict[str, Dict[int, FollowTask]] = {}
+        self._tasks: Dict[int, FollowTask] = {}
+        self._synced_at: Optional[datetime] = None  # 上次同步時的資料庫時間
+        self._full_sync_at = 0.0
+
+    def upsert(self, task: FollowTask):
+        # 同一帳號不論大小寫或前後空白都歸到同一個監控目標，每輪只抓取一次
+        task = task._replace(follow_user=canonical_target(task.follow_user))
+        self.remove(task.id)
+        self._tasks[task.id] = task
+        self.grouped.setdefault(task.follow_user, {})[task.id] = task
+
+    def remove(self, task_id: int) -> Optional[FollowTask]:
+        task = self._tasks.pop(task_id, None)
+        if task is None:
+            return None
+        tasks = self.grouped.get(task.follow_user)
+        if tasks is not None:
+            tasks.pop(task_id, None)
+            if not tasks:
+                del self.grouped[task.follow_user]
+        return task
+
+    def tasks_for(self, target_user: str) -> List[FollowTask]:
+        return list(self.grouped.get(target_user, {}).values())
+
+    async def sync(self, pool) -> int:
+        """同步訂閱資料，回傳本次套用的資料列數"""
+        full = (
+            self._synced_at is None
+            or time.monotonic() - self._full_sync_at >= Config.SUBSCRIPTION_FULL_SYNC_INTERVAL
+        )
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute("SELECT NOW(3)")
+                synced_at = (await cursor.fetchone())[0]
+
+                if full:
+                    await cursor.execute(
+                        "SELECT id, follow_user, webhook_url, notify, state FROM follow_data WHERE state = 1"
+                    )
+                else:
+                    await cursor.execute(
+                        """
+                        SELECT id, follow_user, webhook_url, notify, state FROM follow_data
+                        WHERE updated_at >= %s - INTERVAL %s SECOND
+                        """,
+                        (self._synced_at, Config.SUBSCRIPTION_SYNC_OVERLAP),
+                    )
+                rows = await cursor.fetchall()
+
+        if full:
+            self.grouped = {}
+            self._tasks = {}
+            self._full_sync_at = time.monotonic()
+        for row in rows:
+            if row[4] == 1:
+                self.upsert(FollowTask(id=row[0], follow_user=row[1], webhook_url=row[2], notify_msg=row[3]))
+            else:
+                self.remove(row[0])
+        self._synced_at = synced_at
+        if full:
+            # 順便校正訂閱計數，修正計數與資料表間累積的誤差
+            await redis_client.set(Config.SUBSCRIPTION_COUNT_KEY, len(self._tasks))
+        return len(rows)
+
+
+# API 與輪詢在同一程序時，新增與停用會直接寫入這份索引
+subscription_index = SubscriptionIndex()
+
+
+class SubscriptionEventChannel:
+    """
+    訂閱新增 / 停用事件：先套用到本程序的索引與排程，再以 Redis pub/sub 通知其他程序。
+
+    新目標會立即排入輪詢並喚醒 scheduler；錯過的事件仍由 SubscriptionIndex 的增量同步補上。
+    """
+
+    def __init__(self, channel: str):
+        self.channel = channel
+        self._wakeup: Optional[asyncio.Event] = None
+        self._listener: Optional[asyncio.Task] = None
+
+    def _get_wakeup(self) -> asyncio.Event:
+        # 在事件迴圈內才建立，避免綁到匯入時的迴圈
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        return self._wakeup
+
+    async def publish_added(self, task: FollowTask):
+        # 只跑 API 的行程沒有輪詢，不必維護本地索引
+        if Config.ROLE in Config.POLLER_ROLES:
+            self._apply_added(task)
+        await self._publish({"op": "add", "task": list(task)})
+
+    async def publish_removed(self, task_id: int):
+        if Config.ROLE in Config.POLLER_ROLES:
+            self._apply_removed(task_id)
+        await self._publish({"op": "remove", "id": task_id})
+
+    async def _publish(self, event: dict):
+        event["origin"] = WORKER_ID
+        try:
+            await redis_client.publish(self.channel, json.dumps(event, ensure_ascii=False))
+        except Exception as e:
+            print(f"⚠️ 訂閱事件發送失敗，改由資料庫同步載入: {e}")
+
+    def _apply_added(self, task: FollowTask):
+        subscription_index.upsert(task)
+        target_user = task.follow_user
+        if poll_scheduler.is_scheduled(target_user):
+            return
+        if Config.WORKER_MODE and not shard_leases.owns(target_user):
+            return
+        # 新目標或重新啟用的目標：立即輪詢，不等下一輪到期
+        poll_scheduler.schedule(target_user, time.time())
+        self._get_wakeup().set()
+
+    def _apply_removed(self, task_id: int):
+        task = subscription_index.remove(task_id)
+        if task is not None and task.follow_user not in subscription_index.grouped:
+            poll_scheduler.discard(task.follow_user)
+
+    async def start(self):
+        if self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+
+    async def _listen(self):
+        while True:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(self.channel)
+                async for message in pubsub.listen():
+                    event = json.loads(message["data"])
+                    if event.get("origin") == WORKER_ID:
+                        continue
+                    if event["op"] == "add":
+                        self._apply_added(FollowTask(*event["task"]))
+                    elif event["op"] == "remove":
+                        self._apply_removed(event["id"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ 訂閱事件頻道中斷，稍後重新訂閱: {e}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+    async def wait(self, timeout: float):
+        """睡到 timeout 秒後，或有新目標加入時提早返回"""
+        wakeup = self._get_wakeup()
+        try:
+            await asyncio.wait_for(wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            return
+        await asyncio.sleep(Config.SUBSCRIPTION_EVENT_DEBOUNCE)
+        wakeup.clear()
+
+
+subscription_events = SubscriptionEventChannel(Config.SUBSCRIPTION_EVENTS_CHANNEL)
+
+
+# 訂閱計數：名額未滿才加一；計數不存在時回傳 -2 讓呼叫端從資料表初始化
+_RESERVE_SUBSCRIPTION_LUA = """
+local current = redis.call('GET', KEYS[1])
+if not current then
+    return -2
+end
+if tonumber(current) >= tonumber(ARGV[1]) then
+    return -1
+end
+return redis.call('INCR', KEYS[1])
+"""
+_RELEASE_SUBSCRIPTION_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('DECR', KEYS[1])
+end
+return 0
+"""
+reserve_subscription_script = redis_client.register_script(_RESERVE_SUBSCRIPTION_LUA)
+release_subscription_script = redis_client.register_script(_RELEASE_SUBSCRIPTION_LUA)
+
+
+async def reserve_subscription_slot(pool, limit: int) -> bool:
+    """原子地佔用一個訂閱名額，已達上限時回傳 False"""
+    result = await reserve_subscription_script(keys=[Config.SUBSCRIPTION_COUNT_KEY], args=[limit])
+    if result == -2:
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute("SELECT COUNT(*) FROM follow_data WHERE state = 1")
+                count = (await cursor.fetchone())[0]
+        await redis_client.set(Config.SUBSCRIPTION_COUNT_KEY, count, nx=True)
+        result = await reserve_subscription_script(keys=[Config.SUBSCRIPTION_COUNT_KEY], args=[limit])
+    return result >= 0
+
+
+async def release_subscription_slot():
+    await release_subscription_script(keys=[Config.SUBSCRIPTION_COUNT_KEY])
 
 
 async def disable_task(pool, task_id: int):
     """發生嚴重錯誤時停用任務"""
     async with pool.acquire() as conn:
         async with conn.cursor() as cursor:
-            await cursor.execute("UPDATE follow_data SET state = 0 WHERE id = %s", (task_id,))
+            await cursor.execute("UPDATE follow_data SET state = 0 WHERE id = %s AND state = 1", (task_id,))
+            disabled = cursor.rowcount == 1
+    await subscription_events.publish_removed(task_id)
+    if disabled:
+        await release_subscription_slot()
 
 
 # --- Twitter 邏輯 ---
-async def get_latest_tweet(target_username: str, auth_user: str, auth_pass: str) -> Optional[TweetResult]:
-    """獲取最新貼文，若用戶不存在則拋出 UserNotFoundError"""
-    token_path = f".twitter_token/{auth_user}"
-    app = Twitter(token_path)
-    
-    try:
-        if not os.path.exists(token_path):
-            await app.sign_in(username=auth_user, password=auth_pass)
-        await app.connect()
-        
-        # 獲取用戶
+async def get_new_tweets(target_username: str, since_ts: Optional[int]) -> List[TweetResult]:
+    """
+    獲取 since_ts 之後的所有新推文（由舊到新），若用戶不存在則拋出 UserNotFoundError。
+
+    由 account_pool 挑選驗證帳號，抓取失敗時讓該帳號冷卻並換下一個帳號重試。
+    """
+    tried = set()
+    for _ in range(min(Config.ACCOUNT_MAX_ATTEMPTS, len(account_pool.passwords))):
+        budget = account_pool.pick(exclude=tried)
+        if budget is None:
+            break
+        auth_user = budget.auth_user
+        auth_pass = account_pool.passwords[auth_user]
+        tried.add(auth_user)
+
+        wait_start = time.monotonic()
+        async with budget.slot():
+            start = time.monotonic()
+            POLL_STAGE_SECONDS.observe(start - wait_start, stage="account_wait")
+            poll_scheduler.polls += 1
+            try:
+                try:
+                    result = await _fetch_new_tweets(target_username, auth_user, auth_pass, since_ts)
+                except TwitterSessionPool.auth_errors():
+                    # session 失效：重新登入後再試一次
+                    await twitter_sessions.invalidate(auth_user)
+                    result = await _fetch_new_tweets(target_username, auth_user, auth_pass, since_ts)
+
+            except UserNotFoundError:
+                # 目標本身的問題，帳號是健康的
+                budget.record_success(time.monotonic() - start)
+                FETCH_TOTAL.inc(account=budget.label, result="not_found")
+                raise
+            except Exception as e:
+                if not account_pool.is_account_error(e):
+                    # 與帳號無關的錯誤（例如目標資料異常）：不扣帳號健康度也不換帳號重試，等下次排程
+                    FETCH_TOTAL.inc(account=budget.label, result="target_error")
+                    print(f"⚠️ 抓取 {target_username} 失敗 (使用帳號 {auth_user}): {e}")
+                    return []
+                cooldown, reason = account_pool.cooldown_for(budget, e)
+                if reason == "auth":
+                    await twitter_sessions.invalidate(auth_user)
+                budget.record_failure(cooldown, reason)
+                FETCH_TOTAL.inc(account=budget.label, result="error")
+                note = f"，帳號冷卻 {cooldown:.0f} 秒" if cooldown else ""
+                print(f"⚠️ 抓取 {target_username} 失敗 (使用帳號 {auth_user}{note}): {e}")
+                continue
+            finally:
+                POLL_STAGE_SECONDS.observe(time.monotonic() - start, stage="fetch")
+
+        budget.record_success(time.monotonic() - start)
+        FETCH_TOTAL.inc(account=budget.label, result="tweet" if result else "empty")
+        return result
+
+    if not tried:
+        # 所有帳號都在冷卻中，本輪跳過，等下次排程
+        FETCH_TOTAL.inc(account="", result="no_account")
+    return []
+
+
+async def _fetch_new_tweets(
+    target_username: str, auth_user: str, auth_pass: str, since_ts: Optional[int]
+) -> List[TweetResult]:
+    app = await twitter_sessions.get(auth_user, auth_pass)
+
+    # 優先使用快取的使用者 ID，直接抓推文
+    user_id = await get_cached_user_id(target_username)
+    if user_id:
         try:
-            user_info = await app.get_user_info(target_username)
-        except TwitterError as e:
-            if "User Account wasn't Found" in str(e) or "Protected" in str(e):
-                raise UserNotFoundError(f"用戶 {target_username} 不存在或已鎖定")
-            raise e
-
-        # 獲取推文
-        all_tweets = await app.get_tweets(user_info)
-        
-        # 尋找第一則非轉推且「有時間」的推文
-        for tweet in all_tweets.tweets:
-            actual_tweet = tweet
-            if hasattr(tweet, "tweets") and tweet.tweets: 
-                actual_tweet = tweet.tweets[0]
-            elif isinstance(tweet, list):
-                actual_tweet = tweet[0]
-
-            # --- 修正點開始 ---
-            # 1. 確保不是轉推
-            # 2. 確保 created_on 不為 None (防呆)
-            if not actual_tweet.is_retweet and actual_tweet.created_on is not None:
-                return TweetResult(url=actual_tweet.url, created_at=actual_tweet.created_on)
-            # --- 修正點結束 ---
-                
-        return None
+            tweets = await _collect_new_tweets(app, int(user_id), target_username, since_ts)
+        except TwitterSessionPool.auth_errors():
+            raise
+        except tweety_errors().TwitterError as e:
+            if not is_target_unavailable(e):
+                # 限流或暫時性錯誤：保留快取，交給 get_new_tweets 換帳號重試
+                raise
+            # 目標可能已停權、鎖定或改為私人，清除快取後重新解析確認
+            await invalidate_user_id(target_username)
+        else:
+            if tweets is not None:
+                return tweets
+            # 該 ID 已改名，帳號名稱可能已不存在或換人使用
+            await invalidate_user_id(target_username)
 
-    except UserNotFoundError:
+    # 獲取用戶與推文；get_user_info 成功但目標受保護或停權時，抓推文才會報錯，兩者都對應到 UserNotFoundError
+    try:
+        user_info = await app.get_user_info(target_username)
+        await cache_user_id(target_username, user_info.id)
+        return await _collect_new_tweets(app, user_info, target_username, since_ts, check_rename=False) or []
+    except tweety_errors().TwitterError as e:
+        if is_target_unavailable(e):
+            raise UserNotFoundError(f"用戶 {target_username} 不存在或已鎖定") from e
         raise
-    except Exception as e:
-        print(f"⚠️ 抓取 {target_username} 失敗 (使用帳號 {auth_user}): {e}")
-        return None
+
+
+async def _collect_new_tweets(
+    app, user, target_username: str, since_ts: Optional[int], check_rename: bool = True
+) -> Optional[List[TweetResult]]:
+    """
+    收集新推文並依時間由舊到新排序；第一次輪詢（沒有 since_ts）只回傳最新一則，避免把整個時間軸推送出去。
+
+    check_rename 時若第一頁的作者都不是該帳號名稱，回傳 None 讓呼叫端重新解析使用者。
+    """
+    new_tweets = []
+    first_page = True
+    async for page in iter_new_tweets(app, user, since_ts):
+        if first_page and check_rename and is_renamed(page.all_tweets, target_username):
+            return None
+        first_page = False
+        new_tweets.extend(page.new_tweets)
+
+    new_tweets.sort(key=lambda tweet: tweet.created_at)
+    if since_ts is None:
+        return new_tweets[-1:]
+    return new_tweets
+
+
+class TimelinePage(NamedTuple):
+    all_tweets: list  # 整頁原始推文，供改名檢查
+    new_tweets: List[TweetResult]  # 本頁比 since_ts 新、且非轉推的推文
+
+
+def _entry_tweets(entry) -> list:
+    """時間軸上一個項目包含的推文：討論串（SelfThread）或對話會展開成多則"""
+    if hasattr(entry, "tweets") and entry.tweets:
+        return list(entry.tweets)
+    if isinstance(entry, list):
+        return entry
+    return [entry]
+
+
+async def iter_new_tweets(app, user, since_ts: Optional[int]):
+    """
+    逐頁抓取使用者時間軸並即時產出每頁的新推文。
+
+    以 since_ts（上次已知的最新推文時間）當游標：某一頁出現已看過的項目時就不再翻頁，
+    沒有游標時只讀第一頁；停機後補抓最多 TIMELINE_MAX_PAGES 頁。
+    討論串或對話以其中最新的一則判斷是否看過，串內較舊的推文不會讓翻頁提早停止。
+    """
+    max_pages = Config.TIMELINE_MAX_PAGES if since_ts is not None else 1
+    pages = app.iter_tweets(user, pages=max_pages, wait_time=Config.TIMELINE_PAGE_WAIT)
+    try:
+        async for _, tweets in pages:
+            TIMELINE_PAGES_TOTAL.inc()
+            new_tweets = []
+            reached_seen = False
+            for entry in tweets:
+                # 跳過轉推與沒有時間的推文 (防呆)
+                members = [
+                    tweet
+                    for tweet in _entry_tweets(entry)
+                    if not getattr(tweet, "is_retweet", False) and getattr(tweet, "created_on", None) is not None
+                ]
+                if not members:
+                    continue
+                if since_ts is not None:
+                    newest = max(int(tweet.created_on.timestamp()) for tweet in members)
+                    if newest <= since_ts:
+                        reached_seen = True
+                        continue
+                    members = [tweet for tweet in members if int(tweet.created_on.timestamp()) > since_ts]
+                new_tweets.extend(TweetResult(url=tweet.url, created_at=tweet.created_on) for tweet in members)
+            yield TimelinePage(all_tweets=tweets, new_tweets=new_tweets)
+            if reached_seen or since_ts is None:
+                break
+    finally:
+        # Python 3.9 沒有 contextlib.aclosing，提早離開時自行關閉產生器，避免繼續翻頁
+        await pages.aclose()
 
 
 # --- 輔助功能 ---
-async def is_new_tweet(username: str, tweet_time: datetime) -> bool:
-    """檢查 Redis 是否為新推文"""
-    cached_time_str = await redis_client.hget(Config.REDIS_KEY_PREFIX, username)
+def _user_id_key(username: str) -> str:
+    return f"{Config.USER_ID_KEY_PREFIX}:{username.lower()}"
 
-    if cached_time_str:
-        cached_time = parser.parse(cached_time_str.decode("utf-8"))
-        if cached_time >= tweet_time:
-            return False
 
-    await redis_client.hset(Config.REDIS_KEY_PREFIX, username, tweet_time.isoformat())
-    return True
+async def get_cached_user_id(username: str) -> Optional[str]:
+    user_id = await redis_client.get(_user_id_key(username))
+    return user_id.decode("utf-8") if user_id else None
+
+
+async def cache_user_id(username: str, user_id: Union[int, str]):
+    await redis_client.set(_user_id_key(username), str(user_id), ex=Config.USER_ID_CACHE_TTL)
+
+
+async def invalidate_user_id(username: str):
+    await redis_client.delete(_user_id_key(username))
+
+
+def is_renamed(tweets, username: str) -> bool:
+    """時間軸上的作者都不是該帳號名稱時，視為已改名"""
+    authors = set()
+    for tweet in tweets:
+        author = getattr(tweet, "author", None)
+        if author is not None and getattr(author, "username", None):
+            authors.add(author.username.lower())
+    return bool(authors) and username.lower() not in authors
+
+
+# 比較並寫入最新推文時間（epoch 秒），兩個 worker 同時輪詢同一用戶也只會有一個判定為新推文
+_UPDATE_LAST_TWEET_LUA = """
+local current = tonumber(redis.call('HGET', KEYS[1], ARGV[1]))
+if current and current >= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+return 1
+"""
+update_last_tweet_script = redis_client.register_script(_UPDATE_LAST_TWEET_LUA)
+
+
+def _parse_cached_time(value: Optional[bytes]) -> Optional[int]:
+    """解析快取時間；相容舊版以 ISO 字串儲存的資料"""
+    if not value:
+        return None
+    value = value.decode("utf-8")
+    if value.isdigit():
+        return int(value)
+    return int(parser.parse(value).timestamp())
+
+
+async def load_last_tweet_times(usernames: List[str]) -> Dict[str, Optional[int]]:
+    """一次 HMGET 取回本輪所有目標的最新推文時間"""
+    if not usernames:
+        return {}
+    values = await redis_client.hmget(Config.REDIS_KEY_PREFIX, usernames)
+    return {username: _parse_cached_time(value) for username, value in zip(usernames, values)}
+
+
+async def load_post_intervals(usernames: List[str]):
+    """把 Redis 中保存的平均發文間隔載入排程器（只載入尚未在記憶體中的目標）"""
+    missing = [username for username in usernames if username not in poll_scheduler.post_intervals]
+    if not missing:
+        return
+    values = await redis_client.hmget(Config.POST_INTERVAL_KEY, missing)
+    for username, value in zip(missing, values):
+        if value:
+            poll_scheduler.post_intervals[username] = float(value)
+
+
+async def record_post_interval(username: str, previous_ts: int, tweet_ts: int):
+    ewma = poll_scheduler.observe_tweet(username, previous_ts, tweet_ts)
+    await redis_client.hset(Config.POST_INTERVAL_KEY, username, f"{ewma:.0f}")
+
+
+async def is_new_tweet(username: str, tweet_time: datetime, cached_time: Optional[int] = None) -> bool:
+    """檢查是否為新推文；cached_time 為本輪開頭取得的快照，可省去沒有新推文時的 Redis 往返"""
+    tweet_ts = int(tweet_time.timestamp())
+    if cached_time is not None and cached_time >= tweet_ts:
+        return False
+
+    updated = await update_last_tweet_script(keys=[Config.REDIS_KEY_PREFIX], args=[username, tweet_ts])
+    return bool(updated)
+
+
+def _webhook_valid_key(url: str) -> str:
+    return f"{Config.WEBHOOK_VALID_KEY_PREFIX}:{hashlib.sha1(url.encode('utf-8')).hexdigest()}"
+
+
+async def is_webhook_validated(url: str) -> bool:
+    return bool(await redis_client.exists(_webhook_valid_key(url)))
+
 
+async def mark_webhook_validated(url: str):
+    await redis_client.set(_webhook_valid_key(url), 1, ex=Config.WEBHOOK_VALIDATION_TTL)
+
+
+async def send_discord_webhook(url: str, content: str, limiter: Optional[WebhookRateLimiter] = None) -> WebhookResult:
+    """發送一則 Webhook，並依回應標頭更新限流狀態"""
+    session = get_http_session()
+    try:
+        async with session.post(url, json={"content": content}) as resp:
+            retry_after = 0.0
+            if resp.status == 429:
+                retry_after = float(resp.headers.get("Retry-After", 0) or 0)
+                try:
+                    retry_after = max(retry_after, float((await resp.json()).get("retry_after", 0)))
+                except Exception:
+                    pass
+                retry_after = retry_after or 1.0
+                if limiter is not None:
+                    limiter.block(url, retry_after, bool(resp.headers.get("X-RateLimit-Global")))
+            elif limiter is not None:
+                limiter.update(url, resp.headers)
+            return WebhookResult(status=resp.status, retry_after=retry_after)
+    except Exception as e:
+        print(f"❌ Webhook 發送錯誤 ({url}): {e}")
+        return WebhookResult(status=0, retry_after=0.0)
+
+
+# 把到期的延遲訊息原子地搬回主佇列，避免 ZREM 與 LPUSH 之間中斷而遺失訊息
+_PROMOTE_DELAYED_LUA = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+for _, raw in ipairs(due) do
+    redis.call('ZREM', KEYS[1], raw)
+    redis.call('LPUSH', KEYS[2], raw)
+end
+return #due
+"""
+promote_delayed_script = redis_client.register_script(_PROMOTE_DELAYED_LUA)
+
+
+class WebhookDeliveryQueue:
+    """以 Redis 持久化的 Webhook 發送佇列，依 Discord 限流提示排程與重試"""
+
+    def __init__(self, workers: int, max_attempts: int):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.limiter = WebhookRateLimiter()
+        self._tasks: List[asyncio.Task] = []
+        # 每個程序各自的處理中清單，避免啟動時把其他存活 worker 正在發送的訊息放回佇列
+        self.processing_key = f"{Config.WEBHOOK_PROCESSING_KEY}:{WORKER_ID}"
+
+    async def enqueue(self, messages: List[Tuple[str, str]]):
+        """將 (webhook_url, content) 寫入佇列，程式重啟也不會遺失"""
+        jobs = [
+            json.dumps(
+                {"id": uuid4().hex, "url": url, "content": content, "attempts": 0, "created": time.time()},
+                ensure_ascii=False,
+            )
+            for url, content in messages
+        ]
+        if jobs:
+            await redis_client.lpush(Config.WEBHOOK_QUEUE_KEY, *jobs)
 
-async def send_discord_webhook(url: str, content: str) -> bool:
-    async with aiohttp.ClientSession() as session:
+    async def start(self):
+        if self._tasks:
+            return
+        await heartbeat_worker()
+        await self._recover()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._promote_delayed()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # 不論是否啟用分片，停止時都退出 worker 名單，重啟後的程序才能立即接手本程序處理中的訊息
         try:
-            async with session.post(url, json={"content": content}) as resp:
-                return resp.status in (200, 204)
+            await redis_client.zrem(Config.WORKER_REGISTRY_KEY, WORKER_ID)
         except Exception as e:
-            print(f"❌ Webhook 發送錯誤 ({url}): {e}")
-            return False
+            print(f"⚠️ 退出 worker 名單失敗: {e}")
+
+    async def _recover(self):
+        """已停止的 worker（不在存活名單中）留下的處理中訊息放回佇列；啟動時與之後定期執行"""
+        alive = await live_workers()
+        async for key in redis_client.scan_iter(match=f"{Config.WEBHOOK_PROCESSING_KEY}*"):
+            key = key.decode("utf-8")
+            owner = key[len(Config.WEBHOOK_PROCESSING_KEY) + 1 :]
+            if owner == WORKER_ID or owner in alive:
+                continue
+            recovered = 0
+            while await redis_client.rpoplpush(key, Config.WEBHOOK_QUEUE_KEY):
+                recovered += 1
+            if recovered:
+                print(f"♻️ 取回已停止 worker {owner or '(舊版)'} 的 {recovered} 則處理中訊息")
+
+    async def _worker(self):
+        while True:
+            try:
+                raw = await redis_client.brpoplpush(
+                    Config.WEBHOOK_QUEUE_KEY, self.processing_key, timeout=5
+                )
+                if raw is not None:
+                    await self._handle(raw)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Webhook 佇列處理錯誤: {e}")
+                await asyncio.sleep(1)
+
+    async def _handle(self, raw: bytes):
+        job = json.loads(raw)
+        url = job["url"]
+
+        # 持續 429 或被限流延後的訊息不會累積重試次數，超過總時間上限就放棄，避免永遠重排
+        created = job.setdefault("created", time.time())
+        if time.time() - created > Config.WEBHOOK_MAX_RETRY_SECONDS:
+            print(f"❌ Webhook 超過 {Config.WEBHOOK_MAX_RETRY_SECONDS} 秒仍未送出，放棄發送 ({url})")
+            WEBHOOK_TOTAL.inc(result="expired")
+            delivery_stats.record(False, 0.0)
+            await self._finish(raw)
+            return
+
+        # 該 Webhook 額度用完，延後到重置時間，不計入重試次數
+        wait = self.limiter.acquire(url)
+        if wait > 0:
+            WEBHOOK_TOTAL.inc(result="deferred")
+            await self._finish(raw, retry=job, delay=wait)
+            return
+
+        start = time.monotonic()
+        result = await send_discord_webhook(url, job["content"], self.limiter)
+        elapsed = time.monotonic() - start
+        WEBHOOK_SECONDS.observe(elapsed)
+
+        if result.status in (200, 204):
+            WEBHOOK_TOTAL.inc(result="success")
+            delivery_stats.record(True, elapsed)
+            await self._finish(raw)
+        elif result.status == 429:
+            WEBHOOK_TOTAL.inc(result="rate_limited")
+            delivery_stats.rate_limited += 1
+            await self._finish(raw, retry=job, delay=result.retry_after)
+        elif result.status == 0 or result.status >= 500:
+            job["attempts"] += 1
+            if job["attempts"] >= self.max_attempts:
+                print(f"❌ Webhook 重試 {job['attempts']} 次仍失敗，放棄發送 ({url})")
+                WEBHOOK_TOTAL.inc(result="failed")
+                delivery_stats.record(False, elapsed)
+                await self._finish(raw)
+            else:
+                WEBHOOK_TOTAL.inc(result="retry")
+                delivery_stats.retried += 1
+                delay = min(Config.WEBHOOK_RETRY_BASE * 2 ** (job["attempts"] - 1), 300)
+                await self._finish(raw, retry=job, delay=delay)
+        else:
+            # 4xx：Webhook 已刪除或內容無效，重試也不會成功
+            print(f"❌ Webhook 發送失敗，狀態碼 {result.status} ({url})")
+            WEBHOOK_TOTAL.inc(result="failed")
+            delivery_stats.record(False, elapsed)
+            await self._finish(raw)
+
+    async def _finish(self, raw: bytes, retry: Optional[dict] = None, delay: float = 0.0):
+        """移出處理中清單；需要重試時同時排入延遲佇列"""
+        pipe = redis_client.pipeline(transaction=True)
+        if retry is not None:
+            pipe.zadd(Config.WEBHOOK_DELAYED_KEY, {json.dumps(retry, ensure_ascii=False): time.time() + delay})
+        pipe.lrem(self.processing_key, 1, raw)
+        await pipe.execute()
+
+    async def _promote_delayed(self):
+        """把到期的延遲訊息搬回主佇列，並順便回報 worker 存活、定期取回已停止 worker 的處理中訊息"""
+        last_heartbeat = last_recover = time.monotonic()
+        while True:
+            try:
+                if time.monotonic() - last_heartbeat >= Config.SHARD_LEASE_TTL / 3:
+                    await heartbeat_worker()
+                    last_heartbeat = time.monotonic()
+                if time.monotonic() - last_recover >= Config.SHARD_LEASE_TTL:
+                    # 異常終止的 worker 會在名單中多留 SHARD_LEASE_TTL 秒，啟動時那次取不回來
+                    await self._recover()
+                    last_recover = time.monotonic()
+                promoted = await promote_delayed_script(
+                    keys=[Config.WEBHOOK_DELAYED_KEY, Config.WEBHOOK_QUEUE_KEY], args=[time.time(), 100]
+                )
+                if not promoted:
+                    await asyncio.sleep(0.5)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Webhook 延遲佇列處理錯誤: {e}")
+                await asyncio.sleep(1)
+
+
+delivery_queue = WebhookDeliveryQueue(
+    workers=Config.WEBHOOK_CONCURRENCY, max_attempts=Config.WEBHOOK_MAX_ATTEMPTS
+)
+
+
+class NotificationBatch:
+    """收集一輪內的所有通知，依 webhook_url 合併成盡量少的 Discord 訊息"""
+
+    SEPARATOR = "\n\n"
+
+    def __init__(self, content_limit: int, max_items: int):
+        self.content_limit = content_limit
+        self.max_items = max_items
+        self._pending: Dict[str, List[str]] = {}
+
+    def add(self, url: str, content: str):
+        self._pending.setdefault(url, []).append(content)
+
+    def _split(self, content: str) -> List[str]:
+        # 單則通知超過上限時切成多段，不丟掉任何內容
+        limit = self.content_limit
+        return [content[i : i + limit] for i in range(0, len(content), limit)] or [content]
+
+    def messages(self) -> List[Tuple[str, str]]:
+        """依加入順序打包，每則訊息不超過字數與通知數上限"""
+        messages = []
+        for url, contents in self._pending.items():
+            parts: List[str] = []
+            length = 0
+            for content in contents:
+                for chunk in self._split(content):
+                    extra = len(chunk) + (len(self.SEPARATOR) if parts else 0)
+                    if parts and (length + extra > self.content_limit or len(parts) >= self.max_items):
+                        messages.append((url, self.SEPARATOR.join(parts)))
+                        parts, length = [], 0
+                        extra = len(chunk)
+                    parts.append(chunk)
+                    length += extra
+            if parts:
+                messages.append((url, self.SEPARATOR.join(parts)))
+        return messages
+
+    async def flush(self):
+        messages = self.messages()
+        if messages:
+            await delivery_queue.enqueue(messages)
+            # 不合併時每段都要單獨送一次；以切段後的段數計算省下的請求數，過長通知被切開時也不會是負值
+            chunks = sum(len(self._split(content)) for contents in self._pending.values() for content in contents)
+            WEBHOOK_BATCHED_TOTAL.inc(max(0, chunks - len(messages)))
+        self._pending = {}
+
+
+async def fan_out(tasks: List[FollowTask], handler):
+    """對同一目標的所有訂閱併發執行 handler，總併發數受 WEBHOOK_CONCURRENCY 限制"""
+    semaphore = get_webhook_semaphore()
+
+    async def run(task: FollowTask):
+        async with semaphore:
+            await handler(task)
+
+    await asyncio.gather(*(run(task) for task in tasks))
 
 
 async def is_network_online() -> bool:
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get("https://www.google.com", timeout=5) as resp:
-                return resp.status == 200
+        session = get_http_session()
+        async with session.get("https://www.google.com", timeout=5) as resp:
+            return resp.status == 200
     except:
         return False
 
 
+def log_event(event: str, **fields):
+    """TWITTER_LOG_JSON=1 時輸出一行 JSON 日誌，方便日誌系統解析"""
+    if Config.LOG_JSON:
+        print(json.dumps({"event": event, "ts": round(time.time(), 3), **fields}, ensure_ascii=False))
+
+
+async def start_metrics_server(port: int) -> "aiohttp.web.AppRunner":
+    """獨立執行輪詢時以 aiohttp 提供 /metrics"""
+    import aiohttp.web
+
+    async def handle(request):
+        if Config.METRICS_TOKEN and not authorized(request.headers.get("Authorization"), Config.METRICS_TOKEN):
+            return aiohttp.web.Response(status=401)
+        return aiohttp.web.Response(body=registry.render().encode("utf-8"), headers={"Content-Type": CONTENT_TYPE})
+
+    app = aiohttp.web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = aiohttp.web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await aiohttp.web.TCPSite(runner, "0.0.0.0", port).start()
+    print(f"📈 指標服務啟動於 :{port}/metrics")
+    return runner
+
+
+def report_cycle(window: float, target_count: int, db_pool: Optional[DatabasePool] = None):
+    """輸出統計週期內的輪詢次數、各驗證帳號使用率、通知延遲與 Webhook 發送狀況"""
+    print(f"📊 過去 {window:.0f} 秒輪詢 {poll_scheduler.polls} 次，目前監控 {target_count} 個目標")
+    now = time.monotonic()
+    for auth_user, budget in account_budgets.items():
+        cooldown = budget.cooldown_remaining(now)
+        print(
+            f"   👤 {auth_user}: 請求 {budget.requests} 次，失敗 {budget.failures} 次，"
+            f"使用率 {budget.utilization(window):.0%}，成功率 {budget.success_rate:.0%}"
+            + (f"，冷卻中剩 {cooldown:.0f} 秒" if cooldown else "")
+        )
+
+    # 與固定間隔輪詢比較：同樣時間內固定輪詢需要的 API 呼叫次數
+    fixed_calls = target_count * window / Config.POLL_INTERVAL
+    delays = sorted(poll_scheduler.notify_delays)
+    median_delay = f"{delays[len(delays) // 2]:.0f} 秒" if delays else "無資料"
+    print(
+        f"   📈 通知延遲中位數 {median_delay}（{len(delays)} 則），"
+        f"API 呼叫 {poll_scheduler.polls} 次，固定 {Config.POLL_INTERVAL} 秒輪詢約需 {fixed_calls:.0f} 次"
+    )
+
+    if delivery_stats.latencies:
+        print(
+            f"   📨 Webhook 成功 {delivery_stats.sent} 則，失敗 {delivery_stats.failed} 則，"
+            f"限流 {delivery_stats.rate_limited} 次，重試 {delivery_stats.retried} 次，"
+            f"{len(delivery_stats.latencies) / window:.1f} 則/秒，"
+            f"延遲 p50 {delivery_stats.percentile(0.5) * 1000:.0f}ms / "
+            f"p95 {delivery_stats.percentile(0.95) * 1000:.0f}ms"
+        )
+    if db_pool is not None and db_pool.acquires:
+        print(
+            f"   🗄️ DB 取得連線 {db_pool.acquires} 次，等待平均 "
+            f"{db_pool.total_wait / db_pool.acquires * 1000:.1f}ms / 最大 {db_pool.max_wait * 1000:.1f}ms"
+        )
+
+    log_event(
+        "poll_cycle",
+        window=round(window, 1),
+        targets=target_count,
+        polls=poll_scheduler.polls,
+        notify_delay_median=delays[len(delays) // 2] if delays else None,
+        webhook_sent=delivery_stats.sent,
+        webhook_failed=delivery_stats.failed,
+        webhook_rate_limited=delivery_stats.rate_limited,
+        webhook_retried=delivery_stats.retried,
+        db_acquires=db_pool.acquires if db_pool is not None else 0,
+        db_max_wait=round(db_pool.max_wait, 4) if db_pool is not None else 0,
+    )
+
+
+def reset_stats(db_pool: Optional[DatabasePool] = None):
+    if db_pool is not None:
+        db_pool.reset_stats()
+    for budget in account_budgets.values():
+        budget.reset_stats()
+    delivery_stats.reset()
+    poll_scheduler.reset_stats()
+
+
 # --- 主程序 ---
-async def process_user_tasks(pool, target_user: str, tasks: List[FollowTask], account_idx: int):
-    """處理單一監控目標的所有任務"""
-    # 輪詢使用 Twitter 帳號
-    auth_user, auth_pass = Config.ACCOUNT_LIST[account_idx % len(Config.ACCOUNT_LIST)]
+async def process_user_tasks(
+    pool,
+    target_user: str,
+    tasks: List[FollowTask],
+    cached_time: Optional[int] = None,
+    batch: Optional[NotificationBatch] = None,
+) -> Optional[int]:
+    """
+    處理單一監控目標的所有任務，回傳已知最新推文時間 (epoch 秒) 供排程使用。
 
+    有 batch 時通知先放進 batch，由呼叫端在本輪結束時依 Webhook 合併發送；否則直接排入發送佇列。
+    """
     try:
-        tweet_data = await get_latest_tweet(target_user, auth_user, auth_pass)
+        # 驗證帳號由 account_pool 依健康狀態挑選
+        new_tweets = await get_new_tweets(target_user, cached_time)
+
+        if not new_tweets:
+            return cached_time
+        # 以最新一則做比較並寫入，兩個 worker 同時輪詢同一用戶時只有一個會推送
+        latest = new_tweets[-1]
+        with POLL_STAGE_SECONDS.time(stage="dedupe"):
+            is_new = await is_new_tweet(target_user, latest.created_at, cached_time)
+
+        if is_new:
+            print(f"🔔 {target_user} 發現 {len(new_tweets)} 則新推文，開始推送...")
+            NEW_TWEETS_TOTAL.inc(len(new_tweets))
+            previous_ts = cached_time
+            for tweet in new_tweets:
+                tweet_ts = int(tweet.created_at.timestamp())
+                if previous_ts is not None:
+                    # 第一次看到的目標沒有前一則推文可比較，不列入延遲統計
+                    delay = time.time() - tweet_ts
+                    poll_scheduler.notify_delays.append(delay)
+                    NOTIFY_DELAY_SECONDS.observe(delay)
+                    await record_post_interval(target_user, previous_ts, tweet_ts)
+                previous_ts = tweet_ts
 
-        if tweet_data and await is_new_tweet(target_user, tweet_data.created_at):
-            print(f"🔔 {target_user} 發現新推文，開始推送...")
-            for task in tasks:
-                msg = f"{task.notify_msg}\n{tweet_data.url}"
-                await send_discord_webhook(task.webhook_url, msg)
+            # 依發文順序推送，每則推文各自通知所有訂閱者（保留各訂閱的通知訊息）
+            notifications = [
+                (task.webhook_url, f"{task.notify_msg}\n{tweet.url}") for tweet in new_tweets for task in tasks
+            ]
+            with POLL_STAGE_SECONDS.time(stage="enqueue"):
+                if batch is not None:
+                    for url, content in notifications:
+                        batch.add(url, content)
+                else:
+                    await delivery_queue.enqueue(notifications)
+            return int(latest.created_at.timestamp())
 
     except UserNotFoundError as e:
         print(f"⛔ {target_user} 帳號異常，發送通知並停用任務。")
@@ -212,45 +1909,132 @@ async def process_user_tasks(pool, target_user: str, tasks: List[FollowTask], ac
 
         # 檢查網路是否正常，避免因網路問題誤判
         if await is_network_online():
-            for task in tasks:
-                await send_discord_webhook(task.webhook_url, error_msg)
-                await disable_task(pool, task.id)
+            await delivery_queue.enqueue([(task.webhook_url, error_msg) for task in tasks])
+            await fan_out(tasks, lambda task: disable_task(pool, task.id))
         else:
             print("⚠️ 檢測到網路異常，跳過停用操作。")
 
+    return cached_time
 
-async def main():
-    db_pool = await create_db_pool()
-    if not db_pool:
+
+async def main(db_pool: DatabasePool):
+    """處理一輪：重新載入任務，輪詢所有已到期的目標並排定下次輪詢時間"""
+    if not await db_pool.health_check():
         return
 
-    try:
-        grouped_tasks = await fetch_active_tasks(db_pool)
+    with SUBSCRIPTION_SYNC_SECONDS.time():
+        await subscription_index.sync(db_pool)
+    targets = list(subscription_index.grouped)
+    if Config.WORKER_MODE:
+        # 只輪詢本 worker 租到的分片
+        targets = [target_user for target_user in targets if shard_leases.owns(target_user)]
+    MONITORED_TARGETS.set(len(targets))
+
+    poll_scheduler.sync(targets)
+    due_targets = poll_scheduler.pop_due(time.time())
+    DUE_TARGETS.set(len(due_targets))
+    if not due_targets:
+        return len(targets)
+    # 先取出任務清單，避免處理途中 API 寫入索引造成不一致
+    grouped_tasks = {target_user: subscription_index.tasks_for(target_user) for target_user in due_targets}
 
-        # 併發處理所有用戶 (可選：如果怕被鎖，可以用 for 迴圈改成序列執行)
-        # 這裡保持原本的邏輯：序列執行
-        for i, (target_user, tasks) in enumerate(grouped_tasks.items()):
-            await process_user_tasks(db_pool, target_user, tasks, i)
+    await twitter_sessions.evict_idle()
+    last_tweet_times = await load_last_tweet_times(due_targets)
+    await load_post_intervals(due_targets)
 
+    # 併發處理所有到期用戶，每個驗證帳號的併發數與請求額度由 AccountBudget 控制；
+    # 通知先收集起來，本輪結束時依 Webhook 合併發送
+    round_start = time.monotonic()
+    batch = NotificationBatch(Config.WEBHOOK_CONTENT_LIMIT, Config.WEBHOOK_BATCH_MAX_ITEMS)
+    try:
+        results = await asyncio.gather(
+            *(
+                process_user_tasks(
+                    db_pool, target_user, grouped_tasks[target_user], last_tweet_times.get(target_user), batch
+                )
+                for target_user in due_targets
+            ),
+            return_exceptions=True,
+        )
     finally:
-        db_pool.close()
-        await db_pool.wait_closed()
+        with POLL_STAGE_SECONDS.time(stage="flush"):
+            await batch.flush()
+
+    now = time.time()
+    for target_user, result in zip(due_targets, results):
+        if isinstance(result, Exception):
+            print(f"💥 處理 {target_user} 時發生未預期錯誤: {result}")
+            result = last_tweet_times.get(target_user)
+        poll_scheduler.schedule(target_user, now + poll_scheduler.interval_for(target_user, result, now))
+
+    round_time = time.monotonic() - round_start
+    ROUND_SECONDS.observe(round_time)
+    log_event("poll_round", targets=len(targets), due=len(due_targets), seconds=round(round_time, 3))
+    if round_time > Config.POLL_MIN_INTERVAL:
+        print(f"⚠️ 本輪 {len(due_targets)} 個目標耗時 {round_time:.1f} 秒，超過最短輪詢間隔")
+    return len(targets)
 
 
-async def scheduler():
+async def scheduler(db_pool: Optional[DatabasePool] = None):
+    """輪詢主迴圈；db_pool 由呼叫端注入時共用該連線池，否則自行建立並在結束時關閉"""
     print(f"🚀 服務啟動，監控 {len(Config.ACCOUNT_LIST)} 個 Twitter 帳號中...")
-    while True:
-        try:
-            await main()
-        except Exception as e:
-            print(f"💥 主迴圈發生未預期錯誤: {e}")
+    # 先載入 tweety，缺少相依套件時在啟動就失敗，而不是等到第一次抓取
+    tweety_errors()
+    owns_pool = db_pool is None
+    if owns_pool:
+        db_pool = DatabasePool()
+        if await db_pool.connect():
+            await ensure_follow_data_schema(db_pool)
+    await delivery_queue.start()
+    await subscription_events.start()
+    if Config.WORKER_MODE:
+        await shard_leases.start()
+    try:
+        target_count = 0
+        window_start = time.monotonic()
+        while True:
+            try:
+                result = await main(db_pool)
+                if result is not None:
+                    target_count = result
+            except Exception as e:
+                print(f"💥 主迴圈發生未預期錯誤: {e}")
+
+            if time.monotonic() - window_start >= Config.POLL_INTERVAL:
+                report_cycle(time.monotonic() - window_start, target_count, db_pool)
+                reset_stats(db_pool)
+                window_start = time.monotonic()
+
+            # 睡到下一個目標到期，至少 POLL_TICK 秒，最多 POLL_MIN_INTERVAL 秒（載入直接改資料庫的變動）；
+            # 有新目標加入時由訂閱事件提早喚醒
+            next_due = poll_scheduler.next_due()
+            delay = Config.POLL_MIN_INTERVAL if next_due is None else next_due - time.time()
+            await subscription_events.wait(min(max(delay, Config.POLL_TICK), Config.POLL_MIN_INTERVAL))
+    finally:
+        if Config.WORKER_MODE:
+            await shard_leases.stop()
+        await subscription_events.stop()
+        await delivery_queue.stop()
+        await twitter_sessions.close_all()
+        await close_http_session()
+        if owns_pool:
+            await db_pool.close()
+
 
-        print(f"💤 等待 900 秒...")
-        await asyncio.sleep(900)
+async def run_standalone():
+    if Config.ROLE not in Config.POLLER_ROLES:
+        print(f"⏸️ TWITTER_ROLE={Config.ROLE}，此行程不執行輪詢")
+        return
+    runner = await start_metrics_server(Config.METRICS_PORT) if Config.METRICS_PORT else None
+    try:
+        await scheduler()
+    finally:
+        if runner is not None:
+            await runner.cleanup()
 
 
 if __name__ == "__main__":
     try:
-        asyncio.run(scheduler())
+        asyncio.run(run_standalone())
     except KeyboardInterrupt:
         print("程式已手動停止")
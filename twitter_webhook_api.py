@@ -1,30 +1,50 @@
 from fastapi import FastAPI, HTTPException, Request
 from pydantic import BaseModel
-import aiomysql
 import os
 from dotenv import load_dotenv
 import uvicorn
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, RedirectResponse
+from fastapi.responses import RedirectResponse
 from contextlib import asynccontextmanager
 import asyncio
-from twitter_hook import main
+from twitter_hook import (
+    DatabasePool,
+    Config,
+    FollowTask,
+    canonical_target,
+    close_http_session,
+    disable_task,
+    get_http_session,
+    is_valid_target,
+    is_webhook_validated,
+    mark_webhook_validated,
+    release_subscription_slot,
+    reserve_subscription_slot,
+    subscription_events,
+)
 import aiohttp
 import json
 import httpx
+import gzip
+import hashlib
+import mimetypes
+import re
+import time
 from pathlib import Path
-from fastapi.responses import JSONResponse
+from typing import Dict, NamedTuple, Optional, Tuple
+from uuid import uuid4
+from fastapi.responses import PlainTextResponse, Response
+from metrics import CONTENT_TYPE, authorized, registry
+
+try:
+    import brotli
+except ImportError:  # 未安裝 brotli 時只提供 gzip
+    brotli = None
 
 
 load_dotenv(dotenv_path=".env")
 
 # 環境變數
-DB_HOST = os.getenv("TWITTER_DB_HOST")
-DB_PORT = int(os.getenv("TWITTER_DB_PORT"))
-DB_USER = os.getenv("TWITTER_DB_USER")
-DB_PASSWORD = os.getenv("TWITTER_DB_PASSWORD")
-DB_DATABASE = os.getenv("TWITTER_DB_DATABASE")
-
 error_webhook = os.getenv("error_webhook")
 username_dict = json.loads(os.getenv("username_dict"))
 username_dict_count = len(username_dict)
@@ -33,36 +53,45 @@ one_username_limit = 15
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # 建立資料庫連線池
-    db_pool = await aiomysql.create_pool(
-        host=DB_HOST,
-        port=DB_PORT,
-        user=DB_USER,
-        password=DB_PASSWORD,
-        db=DB_DATABASE,
-        autocommit=True,
-        minsize=1,
-        maxsize=10,
-    )
+    # 只有兼任輪詢的角色才用到的部分在這裡才匯入（tweety 也只在輪詢啟動時才載入）
+    runs_poller = Config.ROLE in Config.POLLER_ROLES
+    if runs_poller:
+        from twitter_hook import ensure_follow_data_schema, scheduler
+
+    # 建立資料庫連線池（與背景輪詢共用，大小由 TWITTER_DB_POOL_* 設定）
+    db_pool = DatabasePool()
+    # 結構遷移交給輪詢端執行，TWITTER_ROLE=api 的多個 worker 不會同時 ALTER TABLE
+    if await db_pool.connect() and runs_poller:
+        await ensure_follow_data_schema(db_pool)
     app.state.db_pool = db_pool
 
-    # 背景排程任務（每 15 分鐘執行一次）
-    async def scheduler():
-        while True:
-            try:
-                await main()
-            except Exception as e:
-                print(f"排程執行錯誤: {e}")
-            await asyncio.sleep(900)  # 15 分鐘
+    # 載入模板與特效快取
+    await template_store.refresh(force=True)
+    await fx_store.refresh(force=True)
+
+    # 靜態資源指紋化與預先壓縮
+    await static_assets.build()
 
-    app.state.bg_task = asyncio.create_task(scheduler())
+    # Turnstile 驗證（共用連線池）
+    app.state.turnstile = create_turnstile_verifier()
+    await app.state.turnstile.start()
+
+    # 背景排程任務（輪詢、Webhook 發送佇列與分片租約皆由 twitter_hook.scheduler 管理）；
+    # TWITTER_ROLE=api 時不啟動，輪詢交給獨立的 `python twitter_hook.py`，API 可用 uvicorn --workers 擴展
+    app.state.bg_task = None
+    if runs_poller:
+        app.state.bg_task = asyncio.create_task(scheduler(db_pool))
 
     yield
 
+    if app.state.bg_task is not None:
+        app.state.bg_task.cancel()
+        await asyncio.gather(app.state.bg_task, return_exceptions=True)
+    await close_http_session()
+    await app.state.turnstile.close()
+
     # 關閉資料庫連線池
-    db_pool.close()
-    await db_pool.wait_closed()
-    app.state.bg_task.cancel()
+    await db_pool.close()
 
 
 # 初始化 FastAPI 應用
@@ -70,13 +99,48 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
+# --- 監控指標 ---
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "http_request_duration_seconds", "API 請求處理時間", ("method", "route", "status")
+)
+TURNSTILE_VERIFY_SECONDS = registry.histogram(
+    "turnstile_verify_seconds", "向 Turnstile 驗證 token 的耗時", ("result",)
+)
+TURNSTILE_CACHE_HITS_TOTAL = registry.counter("turnstile_cache_hits_total", "命中已驗證 token 快取、不必呼叫 Turnstile 的次數")
+
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    start = time.monotonic()
+    response = await call_next(request)
+    # 以路由樣板當標籤，避免路徑參數讓標籤數量暴增
+    route = request.scope.get("route")
+    HTTP_REQUEST_SECONDS.observe(
+        time.monotonic() - start,
+        method=request.method,
+        route=getattr(route, "path", "unmatched"),
+        status=response.status_code,
+    )
+    return response
+
+
+@app.get("/metrics")
+async def metrics(request: Request):
+    # API 經由通道對外公開：未設定 TWITTER_METRICS_TOKEN 時不提供，設定後需帶 Bearer token
+    if not Config.METRICS_TOKEN:
+        raise HTTPException(status_code=404)
+    if not authorized(request.headers.get("Authorization"), Config.METRICS_TOKEN):
+        raise HTTPException(status_code=401)
+    return PlainTextResponse(registry.render(), media_type=CONTENT_TYPE)
+
+
 # 靜態資源與首頁
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 
-@app.get("/twitterfollow/", response_class=FileResponse)
-async def twitterfollow():
-    return FileResponse("static/twitterfollow.html")
+@app.get("/twitterfollow/")
+async def twitterfollow(request: Request):
+    return await static_assets.page_response(request, "twitterfollow.html")
 
 
 @app.post("/twitterfollow/")
@@ -85,14 +149,16 @@ async def twitterfollow_post(request: Request):
     return RedirectResponse(url="/twitterfollow/", status_code=303)
 
 
-@app.get("/", response_class=FileResponse)
-async def home():
-    return FileResponse("static/index.html")
+@app.get("/")
+async def home(request: Request):
+    return await static_assets.page_response(request, "index.html")
 
 
-@app.get("/obstemplate", response_class=FileResponse)
-async def obstemplate():
-    return FileResponse("static/obstemplate.html")
+@app.get("/obstemplate")
+async def obstemplate(request: Request):
+    # 頁面帶上目前合併特效腳本的版本網址，腳本本身即可長期快取
+    await fx_store.refresh()
+    return await static_assets.page_response(request, "obstemplate.html", fx_bundle_url=fx_store.bundle_url())
 
 
 async def send_webhook_message(webhook_url: str, message: str) -> dict:
@@ -110,86 +176,124 @@ async def send_webhook_message(webhook_url: str, message: str) -> dict:
     payload = {"content": message}
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                webhook_url, data=json.dumps(payload), headers={"Content-Type": "application/json"}
-            ) as response:
-                if response.status == 200 or response.status == 204:
-                    return {"success": True, "message": "訊息發送成功"}
-                else:
-                    return {
-                        "success": False,
-                        "message": f"訊息發送失敗，狀態碼: {response.status}",
-                        "details": await response.text(),
-                    }
+        session = get_http_session()
+        async with session.post(
+            webhook_url, data=json.dumps(payload), headers={"Content-Type": "application/json"}
+        ) as response:
+            if response.status == 200 or response.status == 204:
+                return {"success": True, "message": "訊息發送成功"}
+            else:
+                return {
+                    "success": False,
+                    "message": f"訊息發送失敗，狀態碼: {response.status}",
+                    "details": await response.text(),
+                }
     except aiohttp.ClientError as e:
         return {"success": False, "message": f"訊息發送失敗: {str(e)}"}
 
 
+# 背景驗證工作，保留參照避免被回收
+background_tasks = set()
+
+
+async def test_webhook(webhook_url: str):
+    """
+    發送測試訊息確認 Webhook 可用，成功結果會快取一段時間。
+
+    回傳:
+        str | None: 失敗時的錯誤訊息，成功為 None。
+    """
+    if await is_webhook_validated(webhook_url):
+        return None
+
+    try:
+        session = get_http_session()
+        test_message = {"content": "測試訊息"}
+        async with session.post(webhook_url, json=test_message, timeout=aiohttp.ClientTimeout(total=5)) as response:
+            if response.status != 200 and response.status != 204:
+                return f"Webhook 測試訊息發送失敗，狀態碼: {response.status}"
+    except Exception as e:
+        await send_webhook_message(error_webhook, f"Webhook 測試失敗: {str(e)}")
+        return "Webhook 測試失敗"
+
+    await mark_webhook_validated(webhook_url)
+    return None
+
+
+async def validate_subscription(pool, task_id: int, webhook_url: str):
+    """背景驗證已寫入的訂閱，Webhook 無法使用時停用"""
+    error = await test_webhook(webhook_url)
+    if error:
+        print(f"⛔ 訂閱 {task_id} 的 Webhook 驗證失敗，已停用: {error}")
+        await disable_task(pool, task_id)
+
+
 # 資料庫插入函式
 async def insert_follow_data(pool, follow_user: str, webhook_url: str, notify: str):
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            try:
-                await cur.execute(
-                    """
-                    SELECT COUNT(*) FROM follow_data WHERE state = 1
-                    """
-                )
-                results = await cur.fetchone()
-                count = results[0]
-                limit = username_dict_count * one_username_limit
-                if count >= limit:
-                    return {"message": f"已達到最大訂閱數量: {limit}"}
-            except Exception as e:
-                await send_webhook_message(error_webhook, f"資料庫查詢失敗: {str(e)}")
-                return {"message": "資料庫查詢失敗"}
+    # 以正規化後的帳號名稱寫入，大小寫或空白不同的輸入都對應到同一個監控目標
+    follow_user = canonical_target(follow_user)
+    if not is_valid_target(follow_user):
+        return {"message": "帳號名稱格式錯誤"}
 
-    # 嘗試發送測試訊息到 Webhook
-    async with aiohttp.ClientSession() as session:
-        try:
-            test_message = {"content": "測試訊息"}
-            async with session.post(webhook_url, json=test_message, timeout=5) as response:
-                if response.status != 200 and response.status != 204:
-                    return {"message": f"Webhook 測試訊息發送失敗，狀態碼: {response.status}"}
-        except Exception as e:
-            await send_webhook_message(error_webhook, f"Webhook 測試失敗: {str(e)}")
-            return {"message": "Webhook 測試失敗"}
-
-    # 如果測試訊息成功，繼續執行資料庫插入
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            try:
-                # 查詢當前最大的 id
-                await cur.execute(
-                    """
-                    SELECT MAX(id) FROM follow_data
-                    """
-                )
-                result = await cur.fetchone()
-                max_id = result[0] if result[0] is not None else 0
-                new_id = max_id + 1
-
-                # 插入新資料或更新現有資料
-                await cur.execute(
-                    """
-                    INSERT INTO follow_data (id, follow_user, webhook_url, notify)
-                    VALUES (%s, %s, %s, %s)
-                    ON DUPLICATE KEY UPDATE notify = VALUES(notify)
-                    """,
-                    (
-                        new_id,
-                        follow_user,
-                        webhook_url,
-                        notify,
-                    ),
-                )
-                return {"message": "訂閱成功"}
-            except Exception as e:
-                await send_webhook_message(
-                    error_webhook, f"資料庫插入失敗: {str(e)},{follow_user},{webhook_url},{notify}"
-                )
-                return {"message": "資料庫插入失敗"}
+    # 以 Redis 計數檢查並佔用名額，不需每次掃描資料表
+    limit = username_dict_count * one_username_limit
+    try:
+        if not await reserve_subscription_slot(pool, limit):
+            return {"message": f"已達到最大訂閱數量: {limit}"}
+    except Exception as e:
+        await send_webhook_message(error_webhook, f"資料庫查詢失敗: {str(e)}")
+        return {"message": "資料庫查詢失敗"}
+
+    # 名額已先佔用，沒有真正新增資料列時要歸還
+    inserted = False
+    try:
+        # 嘗試發送測試訊息到 Webhook（背景驗證模式下於寫入後才驗證）
+        validate_later = Config.WEBHOOK_ASYNC_VALIDATION
+        if not validate_later:
+            error = await test_webhook(webhook_url)
+            if error:
+                return {"message": error}
+
+        # 如果測試訊息成功，繼續執行資料庫插入
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                try:
+                    # 插入新資料或更新現有資料，id 由 AUTO_INCREMENT 配發
+                    await cur.execute(
+                        """
+                        INSERT INTO follow_data (follow_user, webhook_url, notify)
+                        VALUES (%s, %s, %s)
+                        ON DUPLICATE KEY UPDATE notify = VALUES(notify)
+                        """,
+                        (
+                            follow_user,
+                            webhook_url,
+                            notify,
+                        ),
+                    )
+                    # rowcount 為 1 代表新增；更新既有資料則交給輪詢端的增量同步處理
+                    inserted = cur.rowcount == 1
+                    if inserted:
+                        # 通知輪詢端立即排入新目標
+                        await subscription_events.publish_added(
+                            FollowTask(
+                                id=cur.lastrowid, follow_user=follow_user, webhook_url=webhook_url, notify_msg=notify
+                            )
+                        )
+                        if validate_later:
+                            task = asyncio.create_task(validate_subscription(pool, cur.lastrowid, webhook_url))
+                            background_tasks.add(task)
+                            task.add_done_callback(background_tasks.discard)
+                            return {"message": "訂閱成功，正在驗證 Webhook，驗證失敗將自動停用"}
+                    return {"message": "訂閱成功"}
+                except Exception as e:
+                    await send_webhook_message(
+                        error_webhook, f"資料庫插入失敗: {str(e)},{follow_user},{webhook_url},{notify}"
+                    )
+                    return {"message": "資料庫插入失敗"}
+    finally:
+        if not inserted:
+            await release_subscription_slot()
 
 
 class SaveData(BaseModel):
@@ -201,19 +305,299 @@ class SaveData(BaseModel):
 TEMPLATE_DIR = Path("templates")
 TEMPLATE_DIR.mkdir(parents=True, exist_ok=True)
 TURNSTILE_SECRET = "0x4AAAAAACDheqBBQkga5_2A8BOuVJZU8G4"
+TURNSTILE_VERIFY_URL = "https://challenges.cloudflare.com/turnstile/v0/siteverify"
+# cloudflare: 呼叫 Cloudflare 驗證；local: 測試與壓測用，不連線、一律通過
+TURNSTILE_MODE = os.getenv("TWITTER_TURNSTILE_MODE", "cloudflare")
+# 已通過驗證的 token 保留秒數，讓同一次操作的重試不必再驗證（Turnstile token 本身只能驗證一次）
+TURNSTILE_CACHE_TTL = 300
+# 模板快取檢查磁碟變動的最短間隔（秒）
+TEMPLATE_CHECK_INTERVAL = 5
+
+
+class CachedPayload(NamedTuple):
+    """預先序列化（並壓縮）的回應內容"""
+
+    body: bytes
+    gzip_body: Optional[bytes]
+    etag: str
+    br_body: Optional[bytes] = None
+
+    @classmethod
+    def from_bytes(cls, body: bytes, compress: bool = True) -> "CachedPayload":
+        etag = f'"{hashlib.sha1(body).hexdigest()[:20]}"'
+        if not compress:
+            return cls(body=body, gzip_body=None, etag=etag)
+        return cls(
+            body=body,
+            gzip_body=gzip.compress(body, compresslevel=9),
+            etag=etag,
+            br_body=brotli.compress(body) if brotli is not None else None,
+        )
+
+    @classmethod
+    def from_data(cls, data) -> "CachedPayload":
+        return cls.from_bytes(json.dumps(data, ensure_ascii=False).encode("utf-8"))
+
+
+# 內容以雜湊版本號定址時使用，內容變動會換網址，可長期快取
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def cached_response(
+    request: Request,
+    payload: CachedPayload,
+    media_type: str = "application/json",
+    cache_control: str = "no-cache",
+) -> Response:
+    """依 If-None-Match 回 304，並依瀏覽器支援回傳 br 或 gzip 版本"""
+    headers = {"ETag": payload.etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if payload.etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+
+    accepted = {encoding.split(";")[0].strip() for encoding in request.headers.get("accept-encoding", "").split(",")}
+    if payload.br_body is not None and "br" in accepted:
+        headers["Content-Encoding"] = "br"
+        return Response(payload.br_body, media_type=media_type, headers=headers)
+    if payload.gzip_body is not None and "gzip" in accepted:
+        headers["Content-Encoding"] = "gzip"
+        return Response(payload.gzip_body, media_type=media_type, headers=headers)
+    return Response(payload.body, media_type=media_type, headers=headers)
+
+
+class DirectoryCache:
+    """
+    目錄內檔案的記憶體快取。
+
+    每隔 check_interval 秒在 thread 中比對檔案 mtime，只重新讀取有變動的檔案；thread 只做檔案 I/O，
+    快取的 dict 一律在事件迴圈中修改，避免與處理請求的程式碼同時存取。
+    子類別實作 _load 決定如何讀取，並可覆寫 _on_change 清除衍生的快取。
+    """
+
+    pattern = "*"
+
+    def __init__(self, directory: Path, check_interval: float):
+        self.directory = directory
+        self.check_interval = check_interval
+        self.items: Dict[str, object] = {}
+        self._mtimes: Dict[str, int] = {}
+        self._checked_at = 0.0
+
+    def _key(self, file_path: Path) -> str:
+        return file_path.name
+
+    def _load(self, file_path: Path):
+        raise NotImplementedError
+
+    def _on_change(self, name: str):
+        pass
+
+    def _scan(self, mtimes: Dict[str, int]) -> Tuple[Dict[str, Tuple[object, int]], set]:
+        """
+        比對磁碟上的檔案與 mtimes 快照（阻塞 I/O，需在 thread 中執行）。
+
+        只讀檔、不動快取：回傳有變動的 {名稱: (內容, mtime)} 與目前存在的檔名，由 _apply 在事件迴圈中套用。
+        """
+        loaded = {}
+        seen = set()
+        for file_path in self.directory.glob(self.pattern):
+            name = self._key(file_path)
+            seen.add(name)
+            try:
+                mtime = file_path.stat().st_mtime_ns
+                if mtimes.get(name) == mtime:
+                    continue
+                loaded[name] = (self._load(file_path), mtime)
+            except Exception as e:
+                # 萬一某個檔案損壞或格式錯誤，印出 Log 但不要讓 API 崩潰
+                print(f"Error reading {file_path}: {e}")
+        return loaded, seen
+
+    def _apply(self, snapshot: Dict[str, int], loaded: Dict[str, Tuple[object, int]], seen: set) -> bool:
+        """在事件迴圈中套用掃描結果，回傳是否有變動；掃描期間已被 put() 更新的項目以較新的為準"""
+        changed = False
+        for name, (content, mtime) in loaded.items():
+            if self._mtimes.get(name) != snapshot.get(name):
+                continue
+            self.items[name] = content
+            self._mtimes[name] = mtime
+            self._on_change(name)
+            changed = True
+
+        for name in snapshot:
+            if name not in seen and name in self.items and self._mtimes.get(name) == snapshot[name]:
+                del self.items[name]
+                self._mtimes.pop(name, None)
+                self._on_change(name)
+                changed = True
+        return changed
+
+    async def refresh(self, force: bool = False):
+        if not force and time.monotonic() - self._checked_at < self.check_interval:
+            return
+        self._checked_at = time.monotonic()
+        snapshot = dict(self._mtimes)
+        loaded, seen = await asyncio.to_thread(self._scan, snapshot)
+        self._apply(snapshot, loaded, seen)
+
+
+class TemplateStore(DirectoryCache):
+    """
+    templates/*.json 的記憶體快取。
+
+    啟動時載入一次，之後由 /savetemplate 直接寫入；
+    磁碟上手動修改的檔案則由定期的 mtime 比對載入。
+    """
+
+    pattern = "*.json"
+
+    def __init__(self, directory: Path):
+        super().__init__(directory, TEMPLATE_CHECK_INTERVAL)
+        self._payloads: Dict[str, CachedPayload] = {}
+        self._all: Optional[CachedPayload] = None
+
+    @property
+    def templates(self) -> Dict[str, dict]:
+        return self.items
+
+    def _key(self, file_path: Path) -> str:
+        # file_path.stem 會取得 "my-style" (從 "templates/my-style.json")
+        return file_path.stem
+
+    def _load(self, file_path: Path):
+        with open(file_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _on_change(self, name: str):
+        self._payloads.pop(name, None)
+        self._all = None
+
+    def put(self, name: str, content: dict, mtime: Optional[int] = None):
+        """/savetemplate 寫入成功後直接更新快取"""
+        self.items[name] = content
+        if mtime is not None:
+            self._mtimes[name] = mtime
+        self._on_change(name)
+
+    def all_payload(self) -> CachedPayload:
+        if self._all is None:
+            self._all = CachedPayload.from_data(self.items)
+        return self._all
+
+    def payload(self, name: str) -> Optional[CachedPayload]:
+        if name not in self.items:
+            return None
+        if name not in self._payloads:
+            self._payloads[name] = CachedPayload.from_data(self.items[name])
+        return self._payloads[name]
+
+
+template_store = TemplateStore(TEMPLATE_DIR)
+
+
+class TurnstileVerifier:
+    """
+    Cloudflare Turnstile 驗證。
+
+    由 lifespan 建立並共用同一個 httpx 連線池，已通過的 token 會短暫快取；
+    驗證耗時、結果與快取命中記錄在 /metrics。子類別覆寫 _siteverify 即可替換驗證來源。
+    """
+
+    def __init__(self, secret: str, cache_ttl: int = TURNSTILE_CACHE_TTL):
+        self.secret = secret
+        self.cache_ttl = cache_ttl
+        self._client: Optional[httpx.AsyncClient] = None
+        self._verified: Dict[str, float] = {}  # token 雜湊 -> 到期時間
+
+    async def start(self):
+        self._client = httpx.AsyncClient(timeout=10)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _siteverify(self, token: str) -> bool:
+        r = await self._client.post(TURNSTILE_VERIFY_URL, data={"secret": self.secret, "response": token})
+        return bool(r.json().get("success"))
+
+    async def verify(self, token: str) -> bool:
+        now = time.monotonic()
+        key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+        if self._verified.get(key, 0) > now:
+            TURNSTILE_CACHE_HITS_TOTAL.inc()
+            return True
+
+        start = time.monotonic()
+        try:
+            success = await self._siteverify(token)
+        except httpx.HTTPError as e:
+            print(f"Turnstile 驗證連線失敗: {e}")
+            success = False
+        latency = time.monotonic() - start
+        TURNSTILE_VERIFY_SECONDS.observe(latency, result="success" if success else "failure")
+        if not success:
+            return False
+
+        # 順便清掉過期的 token
+        self._verified = {k: expiry for k, expiry in self._verified.items() if expiry > now}
+        self._verified[key] = now + self.cache_ttl
+        return True
+
+
+class LocalTurnstileVerifier(TurnstileVerifier):
+    """測試與壓測用的本機替身，不連線 Cloudflare"""
+
+    def __init__(self, accept: bool = True):
+        super().__init__(secret="")
+        self.accept = accept
+
+    async def start(self):
+        pass
+
+    async def _siteverify(self, token: str) -> bool:
+        return self.accept
+
+
+def create_turnstile_verifier() -> TurnstileVerifier:
+    if TURNSTILE_MODE == "local":
+        return LocalTurnstileVerifier()
+    return TurnstileVerifier(TURNSTILE_SECRET)
+
+
+def write_template_exclusive(file_path: Path, content: dict) -> int:
+    """
+    原子地建立模板檔：先寫入暫存檔，再以 hard link 建立目標檔。
+
+    目標檔已存在時拋出 FileExistsError，兩個同名請求只會有一個成功，
+    也不會讓讀取端看到寫到一半的檔案。
+
+    回傳:
+        int: 新檔案的 mtime (ns)，供模板快取使用。
+    """
+    tmp_path = file_path.with_name(f".{file_path.name}.{uuid4().hex}.tmp")
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(content, f, ensure_ascii=False, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.link(tmp_path, file_path)
+        except FileExistsError:
+            raise
+        except OSError:
+            # 檔案系統不支援 hard link：先以 O_EXCL 佔住檔名，再用 replace 原子地換上內容
+            os.close(os.open(file_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            os.replace(tmp_path, file_path)
+        return file_path.stat().st_mtime_ns
+    finally:
+        tmp_path.unlink(missing_ok=True)
 
 
 @app.post("/savetemplate")
-async def save_text(data: SaveData):
+async def save_text(data: SaveData, request: Request):
     # 1. Cloudflare Turnstile 驗證
-    async with httpx.AsyncClient() as client:
-        r = await client.post(
-            "https://challenges.cloudflare.com/turnstile/v0/siteverify",
-            data={"secret": TURNSTILE_SECRET, "response": data.ts_token},
-        )
-    result = r.json()
-
-    if not result.get("success"):
+    if not await request.app.state.turnstile.verify(data.ts_token):
         raise HTTPException(status_code=403, detail="Turnstile 驗證失敗")
 
     # 2. 檔名安全性處理
@@ -228,16 +612,18 @@ async def save_text(data: SaveData):
     # 3. 路徑處理
     file_path = TEMPLATE_DIR / safe_filename
 
-    # *** 新增：檔案存在就失敗 ***
-    if file_path.exists():
+    # *** 新增：檔案存在就失敗 ***（快取中已有就直接拒絕，最終仍以寫入時的原子建立為準）
+    if file_path.stem in template_store.templates:
         raise HTTPException(status_code=409, detail=f"模板 '{safe_filename}' 已存在，無法覆蓋")
 
-    # 4. 執行儲存
+    # 4. 執行儲存（在 thread 中寫入，避免阻塞事件迴圈）
     try:
-        with open(file_path, "w", encoding="utf-8") as f:
-            json.dump(data.cssdata, f, ensure_ascii=False, indent=4)
+        mtime = await asyncio.to_thread(write_template_exclusive, file_path, data.cssdata)
+    except FileExistsError:
+        raise HTTPException(status_code=409, detail=f"模板 '{safe_filename}' 已存在，無法覆蓋")
     except OSError as e:
         raise HTTPException(status_code=500, detail=f"伺服器寫入失敗: {str(e)}")
+    template_store.put(file_path.stem, data.cssdata, mtime)
 
     return {
         "status": "success",
@@ -247,44 +633,214 @@ async def save_text(data: SaveData):
 
 
 @app.get("/gettemplate")
-async def get_all_templates():
-    # 如果資料夾還沒建立，直接回傳空物件
-    if not TEMPLATE_DIR.exists():
-        return {}
+async def get_all_templates(request: Request, name: Optional[str] = None):
+    """回傳所有模板（以檔名為 Key），帶 name 參數時只回傳該模板"""
+    await template_store.refresh()
 
-    all_templates = {}
+    if name is None:
+        return cached_response(request, template_store.all_payload())
 
-    # 搜尋資料夾內所有 .json 檔案
-    for file_path in TEMPLATE_DIR.glob("*.json"):
-        try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                content = json.load(f)
+    payload = template_store.payload(name)
+    if payload is None:
+        raise HTTPException(status_code=404, detail=f"模板 '{name}' 不存在")
+    return cached_response(request, payload)
 
-                # file_path.stem 會取得 "my-style" (從 "templates/my-style.json")
-                # 使用檔名(不含副檔名)作為 Key，方便前端顯示
-                template_name = file_path.stem
 
-                all_templates[template_name] = content
+# 特效腳本放在 static/FX 資料夾下（Linux 上路徑區分大小寫）
+FX_DIR = Path("static/FX")
+FX_DIR.mkdir(parents=True, exist_ok=True)
+FX_CHECK_INTERVAL = 5
 
-        except Exception as e:
-            # 萬一某個檔案損壞或格式錯誤，印出 Log 但不要讓 API 崩潰
-            print(f"Error reading template {file_path}: {e}")
-            continue
 
-    return all_templates
+class FxStore(DirectoryCache):
+    """static/FX/*.js 特效腳本的快取：清單、內容雜湊與合併後的單一腳本"""
 
+    pattern = "*.js"
+
+    def __init__(self, directory: Path):
+        super().__init__(directory, FX_CHECK_INTERVAL)
+        self._derived: Dict[str, CachedPayload] = {}
+        self._scripts: Dict[str, CachedPayload] = {}
+
+    def _load(self, file_path: Path):
+        return file_path.read_bytes()
+
+    def _on_change(self, name: str):
+        self._derived = {}
+        self._scripts.pop(name, None)
+
+    def names(self):
+        return sorted(self.items)
+
+    def script(self, name: str) -> Optional[CachedPayload]:
+        if name not in self.items:
+            return None
+        if name not in self._scripts:
+            self._scripts[name] = CachedPayload.from_bytes(self.items[name])
+        return self._scripts[name]
+
+    def _version(self, payload: CachedPayload) -> str:
+        return payload.etag.strip('"')[:12]
+
+    def bundle(self) -> CachedPayload:
+        """所有特效合併為一支腳本，OBS 頁面只需一次請求"""
+        if "bundle" not in self._derived:
+            parts = [f"/* {name} */\n".encode("utf-8") + self.items[name] + b"\n;\n" for name in self.names()]
+            self._derived["bundle"] = CachedPayload.from_bytes(b"".join(parts))
+        return self._derived["bundle"]
+
+    def bundle_url(self) -> str:
+        return f"/fx/bundle.js?v={self._version(self.bundle())}"
+
+    def list_payload(self) -> CachedPayload:
+        if "list" not in self._derived:
+            self._derived["list"] = CachedPayload.from_data(self.names())
+        return self._derived["list"]
+
+    def manifest(self) -> CachedPayload:
+        if "manifest" not in self._derived:
+            files = [
+                {
+                    "name": name,
+                    "hash": self._version(self.script(name)),
+                    "url": f"/fx/script/{name}?v={self._version(self.script(name))}",
+                }
+                for name in self.names()
+            ]
+            self._derived["manifest"] = CachedPayload.from_data(
+                {"files": files, "bundle": self.bundle_url(), "hash": self._version(self.bundle())}
+            )
+        return self._derived["manifest"]
+
+
+fx_store = FxStore(FX_DIR)
 
-@app.get("/fx/list")
-async def fx_list():
-    # 假設你的特效檔案放在 static/fx 資料夾下
-    folder = "./static/fx"
-    # 如果資料夾不存在就建立，避免報錯
-    if not os.path.exists(folder):
-        os.makedirs(folder)
 
+def versioned_response(request: Request, payload: CachedPayload, version: Optional[str], media_type: str):
+    """網址帶有正確的版本號時回傳長期快取標頭，否則需重新驗證"""
+    if version and payload.etag.strip('"').startswith(version):
+        return cached_response(request, payload, media_type, IMMUTABLE_CACHE_CONTROL)
+    return cached_response(request, payload, media_type)
+
+
+@app.get("/fx/list")
+async def fx_list(request: Request):
     # 讀取所有 .js 檔案
-    files = [f for f in os.listdir(folder) if f.endswith(".js")]
-    return JSONResponse(files)
+    await fx_store.refresh()
+    return cached_response(request, fx_store.list_payload())
+
+
+@app.get("/fx/manifest")
+async def fx_manifest(request: Request):
+    """特效清單與各檔案的內容雜湊"""
+    await fx_store.refresh()
+    return cached_response(request, fx_store.manifest())
+
+
+@app.get("/fx/bundle.js")
+async def fx_bundle(request: Request, v: Optional[str] = None):
+    await fx_store.refresh()
+    return versioned_response(request, fx_store.bundle(), v, "application/javascript")
+
+
+@app.get("/fx/script/{name}")
+async def fx_script(request: Request, name: str, v: Optional[str] = None):
+    await fx_store.refresh()
+    payload = fx_store.script(name)
+    if payload is None:
+        raise HTTPException(status_code=404, detail=f"特效 '{name}' 不存在")
+    return versioned_response(request, payload, v, "application/javascript")
+
+
+# --- 靜態資源指紋化 ---
+STATIC_DIR = Path("static")
+# 可壓縮的檔案類型；圖片本身已壓縮，只做指紋化與長期快取
+COMPRESSIBLE_SUFFIXES = {".html", ".js", ".css", ".json", ".svg", ".txt", ".ico"}
+# HTML 中指向 static/ 的 src / href（忽略原本的 ?v= 查詢字串）
+STATIC_REF_PATTERN = re.compile(r'(?P<attr>src|href)="(?P<path>/?static/[^"?#]+)(?:\?[^"]*)?"')
+# 頁面中告訴 obs.js 合併特效腳本網址的 meta 標籤，回應時換成帶內容雜湊的版本
+FX_BUNDLE_META = '<meta name="fx-bundle" content="/fx/bundle.js">'
+
+
+class StaticAssets:
+    """
+    啟動時建置一次的靜態資源快取。
+
+    每個檔案依內容雜湊產生 /assets/<名稱>.<雜湊><副檔名> 網址並預先壓縮，
+    頁面 HTML 中的 static/ 參照改寫為該網址，讓資源可以 immutable 長期快取。
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.assets: Dict[str, CachedPayload] = {}  # 指紋化路徑 -> 內容
+        self.urls: Dict[str, str] = {}  # static/ 下的相對路徑 -> 指紋化網址
+        self.pages: Dict[str, CachedPayload] = {}
+        self._rendered: Dict[str, Tuple[str, str, CachedPayload]] = {}  # 頁面 -> (原始 ETag, 特效網址, 內容)
+        self._build_lock = asyncio.Lock()
+
+    def _build(self):
+        """讀取、雜湊並壓縮所有靜態檔案（阻塞 I/O，需在 thread 中執行）"""
+        assets, urls = {}, {}
+        for file_path in self.directory.rglob("*"):
+            if not file_path.is_file():
+                continue
+            body = file_path.read_bytes()
+            relative = file_path.relative_to(self.directory).as_posix()
+            digest = hashlib.sha1(body).hexdigest()[:10]
+            hashed = f"{relative[: -len(file_path.suffix)] if file_path.suffix else relative}.{digest}{file_path.suffix}"
+            assets[hashed] = CachedPayload.from_bytes(body, compress=file_path.suffix.lower() in COMPRESSIBLE_SUFFIXES)
+            urls[relative] = f"/assets/{hashed}"
+
+        def rewrite(match):
+            url = urls.get(match.group("path").lstrip("/")[len("static/") :])
+            return f'{match.group("attr")}="{url}"' if url else match.group(0)
+
+        pages = {}
+        for file_path in self.directory.glob("*.html"):
+            html = file_path.read_text(encoding="utf-8")
+            pages[file_path.name] = CachedPayload.from_bytes(STATIC_REF_PATTERN.sub(rewrite, html).encode("utf-8"))
+
+        self.assets, self.urls, self.pages = assets, urls, pages
+        print(f"✅ 靜態資源建置完成，共 {len(assets)} 個檔案")
+
+    async def build(self):
+        async with self._build_lock:
+            await asyncio.to_thread(self._build)
+
+    async def ensure_built(self):
+        if not self.pages:
+            async with self._build_lock:
+                if not self.pages:
+                    await asyncio.to_thread(self._build)
+
+    def _with_fx_bundle(self, name: str, url: str) -> CachedPayload:
+        """把頁面中的特效網址換成目前的版本；同一頁面與版本只重新產生一次"""
+        page = self.pages[name]
+        cached = self._rendered.get(name)
+        if cached is not None and cached[0] == page.etag and cached[1] == url:
+            return cached[2]
+        html = page.body.decode("utf-8").replace(FX_BUNDLE_META, f'<meta name="fx-bundle" content="{url}">')
+        payload = CachedPayload.from_bytes(html.encode("utf-8"))
+        self._rendered[name] = (page.etag, url, payload)
+        return payload
+
+    async def page_response(self, request: Request, name: str, fx_bundle_url: Optional[str] = None) -> Response:
+        await self.ensure_built()
+        payload = self.pages[name] if fx_bundle_url is None else self._with_fx_bundle(name, fx_bundle_url)
+        return cached_response(request, payload, "text/html; charset=utf-8")
+
+
+static_assets = StaticAssets(STATIC_DIR)
+
+
+@app.get("/assets/{path:path}")
+async def fingerprinted_asset(request: Request, path: str):
+    await static_assets.ensure_built()
+    payload = static_assets.assets.get(path)
+    if payload is None:
+        raise HTTPException(status_code=404, detail="檔案不存在")
+    media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    return cached_response(request, payload, media_type, IMMUTABLE_CACHE_CONTROL)
 
 
 class FollowData(BaseModel):
@@ -297,7 +853,6 @@ class FollowData(BaseModel):
 @app.post("/add-follow/")
 async def add_follow(data: FollowData):
     follow_user = data.follow_user
-    follow_user = follow_user.replace("@", "")
     webhook_url = data.webhook_url
     notify = data.notify
     try: